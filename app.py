@@ -1,14 +1,40 @@
 from parser_ import Parser
-from lexer import Tokenizer
-from visualizer import Visualizer, VisualizingMode as vis_mode
+from lexer import tokenizers, map_source_file
+from visualizer import GraphBudget, Visualizer, VisualizingMode as vis_mode
 from logger import create_logger
+from parse_cache import ParseCache, cache_options
+from batch import BatchOptions, expand_inputs, run_batch
+from render_queue import RenderQueue, COMPRESSED_SUFFIX
+from graph_sink import DotWriter
+from profiling import PhaseProfiler
+from rule_profiler import RuleProfiler
+from visitor import count_nodes
 from os.path import isfile
 
 class Parameters:
-    def __init__(self, file_name : str, output : str, mode: vis_mode) -> None:
+    def __init__(self, file_name : str, output : str, mode: vis_mode, lexer: str = 'default', lazy: bool = False, mapped: bool = False, recover: bool = False, cache: str = '',
+                 inputs: list = None, workers: int = 0, chunk_size: int = 8, render_workers: int = 2,
+                 render_timeout: float = 60.0, compress: bool = False, budget: GraphBudget = None,
+                 coalesce: bool = False, profile: str = '', rules_profile: str = '', timings: str = '') -> None:
         self.file_name = file_name
         self.output = output
         self.mode = mode
+        self.lexer = lexer
+        self.lazy = lazy
+        self.mapped = mapped
+        self.recover = recover
+        self.cache = cache
+        self.inputs = inputs if inputs else []
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.render_workers = render_workers
+        self.render_timeout = render_timeout
+        self.compress = compress
+        self.budget = budget if budget else GraphBudget()
+        self.coalesce = coalesce
+        self.profile = profile
+        self.rules_profile = rules_profile
+        self.timings = timings
 
 help_message = '''\nWelcome to AST builder/visualizer\n
 supported parameters:\n
@@ -16,6 +42,25 @@ supported parameters:\n
 -f - input file\n
 -o - output file_name (output/output by default)\n
 -m - visualization mode (AST or CFG)\n
+-l - lexer engine (default or scanner)\n
+-z - zero-copy mode, token and terminal values are sliced from the source on demand\n
+-b - lex the memory-mapped file as bytes (implies scanner lexer and zero-copy mode, spans are byte offsets)\n
+-r - recovery mode, unsupported or broken statements are wrapped and reported as a summary instead of errors\n
+-c - parse cache directory, unchanged files are loaded from it instead of being tokenized and parsed\n
+-d - batch mode input: directory (walked for .py files), glob or file, can be repeated, -o is the output directory\n
+-j - batch mode worker processes (cpu count by default)\n
+-k - batch mode files per worker task (8 by default)\n
+-w - dot processes rendering in parallel with parsing (2 by default)\n
+-t - dot timeout per graph in seconds (60 by default)\n
+-g - write gzip compressed DOT files (<output>.gz)\n
+-x - AST graph max depth, deeper subtrees are replaced by "N hidden nodes" placeholders\n
+-n - AST graph max nodes, the rest of the tree is replaced by placeholders\n
+-s - collapse AST subtrees of at most this many nodes into placeholders\n
+-e - graphs with more nodes are laid out by sfdp instead of dot (4000 by default, 0 - always dot)\n
+-a - CFG mode merges straight-line statements into one basic block node\n
+-p, --profile - JSON report file (- prints it) with wall/CPU time, memory peak, token and node counts of every phase\n
+-u, --profile-rules - collapsed stacks file (flame graph input) with self time of the parser grammar rules\n
+-i, --timings - batch mode report file with the timings of every file (JSON for a .json name, CSV otherwise)\n
 '''
 
 def prepare_params() -> Parameters:
@@ -23,6 +68,22 @@ def prepare_params() -> Parameters:
     file_name = ''
     output = ''
     mode = vis_mode.AST
+    lexer = 'default'
+    lazy = False
+    mapped = False
+    recover = False
+    cache = ''
+    inputs = []
+    workers = 0
+    chunk_size = 8
+    render_workers = 2
+    render_timeout = 60.0
+    compress = False
+    budget = GraphBudget()
+    coalesce = False
+    profile = ''
+    rules_profile = ''
+    timings = ''
 
     for i in range(len(argv)):
         if argv[i][0] == '-':
@@ -39,8 +100,86 @@ def prepare_params() -> Parameters:
             elif key == 'm':
                 i += 1
                 mode = vis_mode.AST if argv[i].lower() == 'ast' else vis_mode.CFG
-    return Parameters(file_name, output, mode)
+            elif key == 'l':
+                i += 1
+                lexer = argv[i].lower()
+                if lexer not in tokenizers:
+                    raise ValueError(f'Unknown lexer engine {lexer}')
+            elif key == 'z':
+                lazy = True
+            elif key == 'b':
+                mapped = True
+            elif key == 'r':
+                recover = True
+            elif key == 'c':
+                i += 1
+                cache = argv[i]
+            elif key == 'd':
+                i += 1
+                inputs.append(argv[i])
+            elif key == 'j':
+                i += 1
+                workers = int(argv[i])
+            elif key == 'k':
+                i += 1
+                chunk_size = int(argv[i])
+            elif key == 'w':
+                i += 1
+                render_workers = int(argv[i])
+            elif key == 't':
+                i += 1
+                render_timeout = float(argv[i])
+            elif key == 'g':
+                compress = True
+            elif key == 'x':
+                i += 1
+                budget.max_depth = int(argv[i])
+            elif key == 'n':
+                i += 1
+                budget.max_nodes = int(argv[i])
+            elif key == 's':
+                i += 1
+                budget.collapse_size = int(argv[i])
+            elif key == 'e':
+                i += 1
+                budget.dot_node_limit = int(argv[i])
+            elif key == 'a':
+                coalesce = True
+            elif key in ('p', '-profile'):
+                i += 1
+                profile = argv[i]
+            elif key in ('u', '-profile-rules'):
+                i += 1
+                rules_profile = argv[i]
+            elif key in ('i', '-timings'):
+                i += 1
+                timings = argv[i]
+    return Parameters(file_name, output, mode, lexer, lazy, mapped, recover, cache, inputs, workers, chunk_size,
+                      render_workers, render_timeout, compress, budget, coalesce, profile, rules_profile, timings)
+
 
+def run_batch_mode(params: Parameters, logger, profiler: PhaseProfiler):
+    files = expand_inputs(params.inputs)
+    if not files:
+        logger.error(f'No python files found in {params.inputs}')
+        return
+    options = BatchOptions(params.output, params.mode, params.lexer, params.lazy, params.recover, params.cache,
+                           params.render_workers, params.render_timeout, params.compress, params.budget, params.coalesce)
+    logger.info(f'Processing {len(files)} files...')
+    with profiler.phase('batch') as phase:
+        summary = run_batch(files, options, params.workers, params.chunk_size, logger)
+    phase.counts['files'] = len(files)
+    phase.counts['tokens'] = sum(result.tokens for result in summary.results)
+    phase.counts['nodes'] = sum(result.nodes for result in summary.results)
+    phase.counts['graph_nodes'] = sum(result.graph_nodes for result in summary.results)
+    phase.counts['cached'] = sum(result.cached for result in summary.results)
+    # per file phases run in the workers, their times are summed over the files and overlap with each other
+    for name, (wall_seconds, cpu_seconds) in summary.phase_totals().items():
+        profiler.add(name, wall_seconds, cpu_seconds, 'batch')
+    profiler.add('render', sum(result.render_seconds for result in summary.results), 0.0, 'batch')
+    logger.info(summary.report())
+    if params.timings:
+        summary.write_timings(params.timings)
 
 
 def main():
@@ -51,20 +190,80 @@ def main():
     except Exception as ex:
         logger.error(f'Something went wrong while processing parameters : {repr(ex)}')
         exit()
-    if not isfile(params.file_name):
+    profiler = PhaseProfiler(trace_memory=bool(params.profile))
+    if params.inputs:
+        run_batch_mode(params, logger, profiler)
+    elif not isfile(params.file_name):
         logger.error(f'Input file does not exist or it\'s not a file (-f {params.file_name})')
         exit()
-    input_file = open(params.file_name, 'r').read()
-    tokenizer = Tokenizer(input_file, logger)
-    tokens, error = tokenizer.tokenize()
-    if error :
-        logger.error(repr(error))
-    logger.info('Tokenization is finished.')
-    parser = Parser(tokens, logger)
-    result = parser.parse()
-    logger.info('Parsing is finished.')
-    Visualizer(result, params.file_name, input_file, params.output, logger).visualize(params.mode)
-    logger.info('Visualization is finished.')
+    else:
+        visualize_file(params, logger, profiler)
+    if params.profile:
+        logger.info(f'Profile:\n{profiler.summary()}')
+        profiler.write(params.profile)
+    profiler.stop()
+
+
+def visualize_file(params: Parameters, logger, profiler: PhaseProfiler):
+    with profiler.phase('read') as phase:
+        input_file = map_source_file(params.file_name) if params.mapped else open(params.file_name, 'r').read()
+    phase.counts['characters'] = len(input_file)
+    try:
+        visualize_source(input_file, params, logger, profiler)
+    finally:
+        # lazy tokens, terminals and node labels slice the mapping until the graph is written
+        if params.mapped and input_file:
+            input_file.close()
+
+
+def visualize_source(input_file, params: Parameters, logger, profiler: PhaseProfiler):
+    if params.mapped:
+        tokenizer = tokenizers['scanner'](input_file, logger)
+    else:
+        tokenizer = tokenizers[params.lexer](input_file, logger, params.lazy)
+    cache = ParseCache(params.cache, logger) if params.cache else None
+    options = cache_options(params.lexer, params.lazy, params.mapped, params.recover)
+    cached = None
+    if cache:
+        with profiler.phase('cache') as phase:
+            cached = cache.get(input_file, options)
+            if cached:
+                result = cached[1].to_node()
+        phase.counts['hit'] = int(cached is not None)
+    if cached:
+        logger.info('Parsing result is loaded from the cache.')
+    else:
+        with profiler.phase('tokenize') as phase:
+            tokens, error = tokenizer.tokenize()
+        phase.counts['tokens'] = len(tokens)
+        if error :
+            logger.error(repr(error))
+        logger.info('Tokenization is finished.')
+        rule_profiler = RuleProfiler() if params.rules_profile else None
+        with profiler.phase('parse') as phase:
+            parser = Parser(tokens, logger, input_file if params.lazy or params.mapped else None, recover=params.recover,
+                            rule_profiler=rule_profiler)
+            result = parser.parse()
+        phase.counts['nodes'] = count_nodes(result)
+        if rule_profiler:
+            rule_profiler.write_collapsed(params.rules_profile)
+            logger.info(f'Grammar rules:\n{rule_profiler.summary()}')
+        if parser.diagnostics:
+            logger.warning(f'{len(parser.diagnostics)} statements were not parsed ({parser.diagnostics.summary()})')
+        logger.info('Parsing is finished.')
+        if cache and not error:
+            with profiler.phase('cache put'):
+                cache.put(input_file, tokens, result, options)
+    visualizer = Visualizer(result, params.file_name, input_file, params.output, logger, params.budget, params.coalesce)
+    output = visualizer.output_path(params.mode) + (COMPRESSED_SUFFIX if params.compress else '')
+    with profiler.phase('graph') as phase:
+        visualizer.write(params.mode, DotWriter(output, visualizer.graph_name()))
+    phase.counts['graph_nodes'] = visualizer.id
+    with profiler.phase('render'):
+        with RenderQueue(logger, 1, 1, params.render_timeout) as renderer:
+            renderer.submit(None, output, engine=visualizer.layout_engine())
+    if all(render.ok for render in renderer.results):
+        logger.info('Visualization is finished.')
 
 
 if __name__ == "__main__":
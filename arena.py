@@ -0,0 +1,356 @@
+import gc
+from array import array
+from typing import Dict, Iterator, List, Union
+import nodes
+from lexer import Token
+from lexer_utils import TokenType
+from text_span import TextSpan
+
+# kind 0 is an empty (None) child slot, kind 1 a raw token kept in the tree
+node_types: List[type] = [type(None), Token] + [
+    cls for cls in vars(nodes).values() if isinstance(cls, type) and issubclass(cls, nodes.BaseNode)]
+kind_ids: Dict[type, int] = {node_type: kind for kind, node_type in enumerate(node_types)}
+
+# field 0 means a plain positional child
+field_names: List[str] = ['']
+for node_type in node_types[2:]:
+    for field_name in node_type._fields:
+        if field_name not in field_names:
+            field_names.append(field_name)
+field_names.append('wrapped_tokens')
+field_ids: Dict[str, int] = {name: index for index, name in enumerate(field_names)}
+
+NO_NODE = -1
+# a field code is (field id << 1) | 1 for values kept outside of children (annotation, wrapped tokens)
+DETACHED = 1
+
+token_types: Dict[int, TokenType] = {token_type.value: token_type for token_type in TokenType}
+
+# payload meaning of a node kind in to_node
+PLAIN_LAYOUT = 0
+TERMINAL_LAYOUT = 1
+WRAPPER_LAYOUT = 2
+_kind_layouts: list = []
+
+
+def kind_layouts() -> list:
+    """(node class, child fields, payload layout) by kind, None for the empty slot and raw token kinds"""
+    if not _kind_layouts:
+        _kind_layouts.extend([None, None])
+        for node_type in node_types[2:]:
+            layout = PLAIN_LAYOUT
+            if issubclass(node_type, nodes.Terminal):
+                layout = TERMINAL_LAYOUT
+            elif node_type is nodes.WrapperNode:
+                layout = WRAPPER_LAYOUT
+            _kind_layouts.append((node_type, node_type._fields, layout))
+    return _kind_layouts
+
+
+def new_object(kind: int, span: TextSpan, value):
+    """Node, raw token or None of the kind without children, value is the interned payload"""
+    if kind == 0:
+        return None
+    if kind == 1:
+        token_type, text = value
+        token = Token(token_types[token_type], text, 0)
+        token.span = span
+        return token
+    node_type, empty_fields, layout = kind_layouts()[kind]
+    node = node_type.__new__(node_type)
+    node.span = span
+    node.children = []
+    for name in empty_fields:
+        setattr(node, name, None)
+    if layout == TERMINAL_LAYOUT:
+        node._value = value
+        node._source = None
+    elif layout == WRAPPER_LAYOUT:
+        node.name = value
+        node.wrapped_tokens = []
+    return node
+
+
+class Arena:
+    """AST stored as parallel columns, nodes are numbered in pre-order and node 0 is the root
+
+    A node has a kind (index in node_types), span begin/end (-1 when there is no span), the first child
+    and the next sibling, a payload (index in values: terminal value, wrapper name or (token type, value))
+    and the code of the parent field it fills.
+    """
+
+    def __init__(self) -> None:
+        self.kinds = array('i')
+        self.begins = array('i')
+        self.ends = array('i')
+        self.first_child = array('i')
+        self.next_sibling = array('i')
+        self.payloads = array('i')
+        self.fields = array('i')
+        self.values: List[object] = []
+        self._value_ids: Dict[object, int] = {}
+        self._last_child = array('i')
+
+    def add(self, kind: int, span: TextSpan, payload: int = NO_NODE, field: int = 0) -> int:
+        if self._last_child is None:
+            self.restore_build_state()
+        index = len(self.kinds)
+        self.kinds.append(kind)
+        self.begins.append(span.begin if span is not None else -1)
+        self.ends.append(span.end if span is not None else -1)
+        self.first_child.append(NO_NODE)
+        self.next_sibling.append(NO_NODE)
+        self.payloads.append(payload)
+        self.fields.append(field)
+        self._last_child.append(NO_NODE)
+        return index
+
+    def link(self, parent: int, child: int):
+        last = self._last_child[parent]
+        if last == NO_NODE:
+            self.first_child[parent] = child
+        else:
+            self.next_sibling[last] = child
+        self._last_child[parent] = child
+
+    def set_span(self, index: int, span: TextSpan):
+        self.begins[index] = span.begin if span is not None else -1
+        self.ends[index] = span.end if span is not None else -1
+
+    def intern(self, value) -> int:
+        if self._value_ids is None:
+            self.restore_build_state()
+        value_id = self._value_ids.get(value)
+        if value_id is None:
+            value_id = self._value_ids[value] = len(self.values)
+            self.values.append(value)
+        return value_id
+
+    def append_tree(self, node: Union[nodes.BaseNode, Token], parent: int = NO_NODE, field: int = 0) -> int:
+        """Copies the node subtree into the arena as the last child of parent"""
+        first = len(self.kinds)
+        stack = [(node, parent, field)]
+        while stack:
+            current, parent, field = stack.pop()
+            if current is None:
+                index = self.add(0, None, NO_NODE, field)
+                children = ()
+            elif isinstance(current, Token):
+                index = self.add(1, current.span, self.intern((current.type.value, current.value)), field)
+                children = ()
+            else:
+                payload = NO_NODE
+                if isinstance(current, nodes.Terminal):
+                    payload = self.intern(current.value)
+                elif isinstance(current, nodes.WrapperNode):
+                    payload = self.intern(current.name)
+                index = self.add(kind_ids[type(current)], current.span, payload, field)
+                children = self.child_entries(current)
+            if parent != NO_NODE:
+                self.link(parent, index)
+            for child, child_field in reversed(children):
+                stack.append((child, index, child_field))
+        return first
+
+    @staticmethod
+    def child_entries(node: nodes.BaseNode) -> list:
+        by_id = {}
+        detached = []
+        for name in node._fields:
+            value = getattr(node, name)
+            if value is not None:
+                by_id[id(value)] = field_ids[name] << 1
+        entries = [(child, by_id.pop(id(child), 0)) for child in getattr(node, 'children', ())]
+        for name in node._fields:
+            value = getattr(node, name)
+            if value is not None and id(value) in by_id:
+                detached.append((value, by_id.pop(id(value)) | DETACHED))
+        if isinstance(node, nodes.WrapperNode) and node.wrapped_tokens:
+            code = field_ids['wrapped_tokens'] << 1 | DETACHED
+            detached.extend((token, code) for token in node.wrapped_tokens)
+        return entries + detached
+
+    def child_indices(self, index: int) -> Iterator[int]:
+        child = self.first_child[index]
+        while child != NO_NODE:
+            yield child
+            child = self.next_sibling[child]
+
+    def span_at(self, index: int) -> TextSpan:
+        begin = self.begins[index]
+        return TextSpan(begin, self.ends[index] - begin) if begin >= 0 else None
+
+    def view(self, index: int = 0) -> 'ArenaNode':
+        return ArenaNode(self, index)
+
+    def subtree_end(self, index: int) -> int:
+        """One past the last node of the subtree at index, subtrees are contiguous in pre-order"""
+        last = index
+        while (child := self.first_child[last]) != NO_NODE:
+            while (sibling := self.next_sibling[child]) != NO_NODE:
+                child = sibling
+            last = child
+        return last + 1
+
+    def to_node(self, index: int = 0) -> nodes.BaseNode:
+        """Builds the object tree for the subtree at index in one pass over its pre-order range
+
+        A node's first child follows it and its next sibling shares its parent, so parents are known before their
+        children are reached and every object is attached to its parent right after it is created. The garbage
+        collector is paused meanwhile, every object it would scan is part of the new tree and stays alive.
+        """
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            return self.build_objects(index)
+        finally:
+            if collecting:
+                gc.enable()
+
+    def build_objects(self, index: int) -> nodes.BaseNode:
+        end = self.subtree_end(index)
+        kinds = self.kinds[index:end].tolist()
+        begins = self.begins[index:end].tolist()
+        ends = self.ends[index:end].tolist()
+        first_child = self.first_child[index:end].tolist()
+        next_sibling = self.next_sibling[index:end].tolist()
+        payloads = self.payloads[index:end].tolist()
+        fields = self.fields[index:end].tolist()
+        values = self.values
+        wrapped_tokens = field_ids['wrapped_tokens']
+        count = end - index
+        built = [None] * count
+        parents = [NO_NODE] * count
+        for offset in range(count):
+            begin = begins[offset]
+            payload = payloads[offset]
+            current = new_object(kinds[offset], TextSpan(begin, ends[offset] - begin) if begin >= 0 else None,
+                                 values[payload] if payload != NO_NODE else None)
+            built[offset] = current
+
+            child = first_child[offset]
+            if child != NO_NODE:
+                parents[child - index] = offset
+            sibling = next_sibling[offset]
+            parent = parents[offset]
+            if sibling != NO_NODE and sibling < end:
+                parents[sibling - index] = parent
+            if parent == NO_NODE:
+                continue
+            parent_node = built[parent]
+            code = fields[offset]
+            if not code & DETACHED:
+                parent_node.children.append(current)
+            if code >> 1 == wrapped_tokens:
+                parent_node.wrapped_tokens.append(current)
+            elif code >> 1:
+                setattr(parent_node, field_names[code >> 1], current)
+        return built[0]
+
+    def make_object(self, index: int):
+        payload = self.payloads[index]
+        return new_object(self.kinds[index], self.span_at(index), self.values[payload] if payload != NO_NODE else None)
+
+    @property
+    def nbytes(self) -> int:
+        columns = (self.kinds, self.begins, self.ends, self.first_child, self.next_sibling, self.payloads, self.fields)
+        return sum(column.itemsize * len(column) for column in columns)
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def restore_build_state(self):
+        """Rebuilds the lookups used only for appending, they are dropped when the arena is pickled or loaded"""
+        self._value_ids = {value: index for index, value in enumerate(self.values)}
+        self._last_child = array('i', [NO_NODE]) * len(self.kinds)
+        for index, parent_first in enumerate(self.first_child):
+            if parent_first == NO_NODE:
+                continue
+            child = parent_first
+            while self.next_sibling[child] != NO_NODE:
+                child = self.next_sibling[child]
+            self._last_child[index] = child
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_value_ids'] = None
+        state['_last_child'] = None
+        return state
+
+
+class ArenaNode:
+    """Read-only view of an arena node with the attributes of the matching nodes class"""
+    __slots__ = ('_arena', '_index')
+
+    def __init__(self, arena: Arena, index: int) -> None:
+        self._arena = arena
+        self._index = index
+
+    @property
+    def node_type(self) -> type:
+        return node_types[self._arena.kinds[self._index]]
+
+    @property
+    def span(self) -> TextSpan:
+        return self._arena.span_at(self._index)
+
+    @property
+    def children(self) -> list:
+        arena = self._arena
+        return [self.wrap(child) for child in arena.child_indices(self._index) if not arena.fields[child] & DETACHED]
+
+    @property
+    def value(self) -> str:
+        if not issubclass(self.node_type, nodes.Terminal):
+            raise AttributeError('value')
+        return self._arena.values[self._arena.payloads[self._index]]
+
+    @property
+    def name(self) -> str:
+        node_type = self.node_type
+        if node_type is nodes.WrapperNode:
+            return self._arena.values[self._arena.payloads[self._index]]
+        if 'name' in node_type._fields:
+            return self.field('name')
+        raise AttributeError('name')
+
+    @property
+    def wrapped_tokens(self) -> List[Token]:
+        if self.node_type is not nodes.WrapperNode:
+            raise AttributeError('wrapped_tokens')
+        code = field_ids['wrapped_tokens'] << 1 | DETACHED
+        arena = self._arena
+        return [self.wrap(child) for child in arena.child_indices(self._index) if arena.fields[child] == code]
+
+    def field(self, name: str):
+        code = field_ids[name] << 1
+        arena = self._arena
+        for child in arena.child_indices(self._index):
+            if arena.fields[child] | DETACHED == code | DETACHED:
+                return self.wrap(child)
+        return None
+
+    def wrap(self, index: int):
+        kind = self._arena.kinds[index]
+        if kind == 0:
+            return None
+        if kind == 1:
+            return self._arena.make_object(index)
+        return ArenaNode(self._arena, index)
+
+    def __getattr__(self, name: str):
+        if name in self.node_type._fields:
+            return self.field(name)
+        raise AttributeError(name)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ArenaNode) and other._arena is self._arena and other._index == self._index
+
+    def __hash__(self) -> int:
+        return hash((id(self._arena), self._index))
+
+    def __str__(self) -> str:
+        return f'{self.node_type.__name__}{self.span}'
+
+    def __repr__(self) -> str:
+        return self.__str__()
@@ -0,0 +1,248 @@
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob, has_magic
+from itertools import repeat
+from logging import getLogger, Logger, NullHandler
+from time import perf_counter, process_time
+from typing import Dict, Iterable, List, Tuple
+from lexer import tokenizers
+from parser_ import Parser
+from parse_cache import ParseCache, cache_options
+from render_queue import RenderQueue, COMPRESSED_SUFFIX
+from graph_sink import DotWriter
+from visualizer import GraphBudget, Visualizer, VisualizingMode as vis_mode
+from visitor import count_nodes
+
+
+class BatchOptions:
+    def __init__(self, output: str, mode: vis_mode, lexer: str = 'default', lazy: bool = False, recover: bool = False,
+                 cache: str = '', render_workers: int = 2, render_timeout: float = 60.0, compress: bool = False,
+                 budget: GraphBudget = None, coalesce: bool = False) -> None:
+        self.output = output if output else 'output'
+        self.mode = mode
+        self.lexer = lexer
+        self.lazy = lazy
+        self.recover = recover
+        self.cache = cache
+        self.render_workers = render_workers
+        self.render_timeout = render_timeout
+        self.compress = compress
+        self.budget = budget
+        self.coalesce = coalesce
+
+
+# phases of process_file, a cache hit replaces tokenize, parse and cache put
+FILE_PHASES = ('read', 'cache', 'tokenize', 'parse', 'cache put', 'graph')
+
+
+class FileResult:
+    def __init__(self, file_name: str, seconds: float, tokens: int = 0, error: str = '', cached: bool = False,
+                 output: str = '', engine: str = 'dot', phases: Dict[str, Tuple[float, float]] = None,
+                 nodes: int = 0, graph_nodes: int = 0) -> None:
+        self.file_name = file_name
+        self.seconds = seconds
+        self.render_seconds = 0.0
+        # (wall, cpu) seconds by name of the phases the file went through
+        self.phases = phases if phases else {}
+        self.tokens = tokens
+        self.nodes = nodes
+        self.graph_nodes = graph_nodes
+        self.error = error
+        self.cached = cached
+        self.output = output
+        self.engine = engine
+
+    @property
+    def ok(self) -> bool:
+        return not self.error
+
+
+def expand_inputs(patterns: Iterable[str]) -> List[str]:
+    """Python files from directories (walked recursively), glob patterns and plain file names, without duplicates"""
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for directory, _, names in os.walk(pattern):
+                files.extend(os.path.join(directory, name) for name in sorted(names) if name.endswith('.py'))
+        elif has_magic(pattern):
+            files.extend(name for name in sorted(glob(pattern, recursive=True)) if os.path.isfile(name))
+        elif os.path.isfile(pattern):
+            files.append(pattern)
+    return list(dict.fromkeys(files))
+
+
+def output_name(options: BatchOptions, file_name: str) -> str:
+    relative = os.path.splitext(os.path.relpath(file_name))[0]
+    relative = relative.replace('..' + os.sep, '').lstrip(os.sep)
+    return os.path.join(options.output, relative)
+
+
+def worker_logger() -> Logger:
+    logger = getLogger('batch_worker')
+    if not logger.handlers:
+        logger.addHandler(NullHandler())
+        logger.propagate = False
+    return logger
+
+
+# caches of this process by directory
+_caches: Dict[str, ParseCache] = {}
+
+
+def worker_cache(directory: str, logger: Logger) -> ParseCache:
+    cache = _caches.get(directory)
+    if cache is None:
+        cache = _caches[directory] = ParseCache(directory, logger)
+    return cache
+
+
+class PhaseClock:
+    """Wall and CPU time between consecutive laps, by phase name"""
+
+    def __init__(self) -> None:
+        self.phases: Dict[str, Tuple[float, float]] = {}
+        self.wall, self.cpu = perf_counter(), process_time()
+
+    def lap(self, name: str):
+        wall, cpu = perf_counter(), process_time()
+        self.phases[name] = (wall - self.wall, cpu - self.cpu)
+        self.wall, self.cpu = wall, cpu
+
+
+def process_file(file_name: str, options: BatchOptions) -> FileResult:
+    """Parses the file and streams the DOT file to the output directory, rendering is left to the render queue"""
+    logger = worker_logger()
+    started = perf_counter()
+    clock = PhaseClock()
+    tokens_count = nodes_count = 0
+    cached = False
+    try:
+        source = open(file_name, 'r').read()
+        clock.lap('read')
+        cache = worker_cache(options.cache, logger) if options.cache else None
+        key_options = cache_options(options.lexer, options.lazy, recover=options.recover)
+        hit = cache.get(source, key_options) if cache else None
+        if hit:
+            tokens, arena = hit
+            root = arena.to_node()
+            cached = True
+        if cache:
+            clock.lap('cache')
+        if not hit:
+            tokens, error = tokenizers[options.lexer](source, logger, options.lazy).tokenize()
+            clock.lap('tokenize')
+            if error:
+                raise error
+            root = Parser(tokens, logger, source if options.lazy else None, recover=options.recover).parse()
+            clock.lap('parse')
+            if cache:
+                cache.put(source, tokens, root, key_options)
+                clock.lap('cache put')
+        tokens_count = len(tokens)
+        visualizer = Visualizer(root, file_name, source, output_name(options, file_name), logger, options.budget,
+                                options.coalesce)
+        output = visualizer.output_path(options.mode) + (COMPRESSED_SUFFIX if options.compress else '')
+        visualizer.write(options.mode, DotWriter(output, visualizer.graph_name()))
+        clock.lap('graph')
+        nodes_count = count_nodes(root)
+    except Exception as ex:
+        return FileResult(file_name, perf_counter() - started, tokens_count, repr(ex), cached, phases=clock.phases,
+                          nodes=nodes_count)
+    return FileResult(file_name, perf_counter() - started, tokens_count, cached=cached, output=output,
+                      engine=visualizer.layout_engine(), phases=clock.phases, nodes=nodes_count,
+                      graph_nodes=visualizer.id)
+
+
+class BatchSummary:
+    def __init__(self, results: List[FileResult], seconds: float, workers: int) -> None:
+        self.results = results
+        self.seconds = seconds
+        self.workers = workers
+
+    @property
+    def failures(self) -> List[FileResult]:
+        return [result for result in self.results if not result.ok]
+
+    def report(self, slowest: int = 10) -> str:
+        files = len(self.results)
+        tokens = sum(result.tokens for result in self.results)
+        cached = sum(result.cached for result in self.results)
+        rendering = sum(result.render_seconds for result in self.results)
+        lines = [
+            f'Processed {files} files with {self.workers} workers in {self.seconds:.2f}s, {rendering:.2f}s spent in rendering '
+            f'({files / self.seconds if self.seconds else 0:.1f} files/s, {tokens / self.seconds if self.seconds else 0:.0f} tokens/s)',
+            f'Succeeded: {files - len(self.failures)}, failed: {len(self.failures)}, from cache: {cached}',
+        ]
+        if self.results:
+            lines.append('Slowest files:')
+            for result in sorted(self.results, key=lambda result: -result.seconds - result.render_seconds)[:slowest]:
+                lines.append(f'  {result.seconds:8.3f}s + {result.render_seconds:8.3f}s render  {result.file_name}')
+        if self.failures:
+            lines.append('Failures:')
+            for result in self.failures:
+                lines.append(f'  {result.file_name}: {result.error}')
+        return '\n'.join(lines)
+
+    def phase_totals(self) -> Dict[str, Tuple[float, float]]:
+        """(wall, cpu) seconds of every file phase summed over the files, in the order the phases run"""
+        totals = {}
+        for name in FILE_PHASES:
+            spent = [result.phases[name] for result in self.results if name in result.phases]
+            if spent:
+                totals[name] = (sum(wall for wall, _ in spent), sum(cpu for _, cpu in spent))
+        return totals
+
+    def timings(self) -> List[dict]:
+        rows = []
+        for result in self.results:
+            row = {'file': result.file_name, 'seconds': result.seconds}
+            for name in FILE_PHASES:
+                row[name.replace(' ', '_') + '_seconds'] = result.phases.get(name, (0.0, 0.0))[0]
+            row.update({'render_seconds': result.render_seconds, 'tokens': result.tokens, 'nodes': result.nodes,
+                        'graph_nodes': result.graph_nodes, 'cached': result.cached, 'error': result.error})
+            rows.append(row)
+        return rows
+
+    def write_timings(self, path: str):
+        """Writes the timings of every file, as JSON when path ends with .json and as CSV otherwise"""
+        rows = self.timings()
+        with open(path, 'w', newline='') as output:
+            if path.endswith('.json'):
+                json.dump(rows, output, indent=2)
+                return
+            writer = csv.DictWriter(output, fieldnames=list(rows[0]) if rows else ['file'])
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def submit_render(renderer: RenderQueue, result: FileResult) -> FileResult:
+    if result.ok:
+        renderer.submit(None, result.output, result.file_name, result.engine)
+    return result
+
+
+def run_batch(file_names: List[str], options: BatchOptions, workers: int = 0, chunk_size: int = 8,
+              logger: Logger = None) -> BatchSummary:
+    """Processes the files in a pool of workers (os.cpu_count() by default), chunk_size files per task
+
+    DOT sources are rendered by a render queue while the workers keep parsing the next files.
+    """
+    workers = workers if workers > 0 else os.cpu_count() or 1
+    started = perf_counter()
+    with RenderQueue(logger if logger else worker_logger(), options.render_workers, 2 * options.render_workers,
+                     options.render_timeout) as renderer:
+        if workers == 1:
+            results = [submit_render(renderer, process_file(file_name, options)) for file_name in file_names]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                processed = executor.map(process_file, file_names, repeat(options), chunksize=max(chunk_size, 1))
+                results = [submit_render(renderer, result) for result in processed]
+    by_file = {render.key: render for render in renderer.results}
+    for result in results:
+        render = by_file.get(result.file_name)
+        if render:
+            result.render_seconds = render.seconds
+            result.error = render.error
+    return BatchSummary(results, perf_counter() - started, workers)
@@ -0,0 +1,400 @@
+from argparse import ArgumentParser
+from glob import glob
+import gc
+from io import StringIO
+import json
+from logging import getLogger, NullHandler
+from time import perf_counter
+import tracemalloc
+from random import Random
+from typing import Dict, List
+from lexer import tokenizers
+from parser_ import Parser, expression_engines
+import serialization
+import synthetic
+from cfg import build_cfg
+from graph_sink import DotWriter
+from visualizer import Visualizer, VisualizingMode
+from visitor import count_nodes
+from arena import Arena
+from lexer_utils import TokenType
+from text_span import TextSpan
+import nodes
+
+logger = getLogger('benchmark_logger')
+logger.addHandler(NullHandler())
+
+
+# constructs the engines lex differently (see ScannerTokenizer), each of them is reported as a mismatch
+engine_differences = {
+    '<string prefix>': 'data = rb"a" + br\'b\'\n',
+    '<triple-quoted string>': 'text = """first\nsecond "quoted" line"""\n',
+    '<line continuation>': 'total = 1 + \\\n    2\n',
+}
+
+
+def read_sources(files: List[str]) -> Dict[str, str]:
+    return {file_name: open(file_name, 'r').read() for file_name in files}
+
+
+def benchmark_tokenizers(sources: Dict[str, str], repeat: int) -> Dict[str, dict]:
+    results = {}
+    reference = None
+    for engine, tokenizer_type in tokenizers.items():
+        tokens_count = 0
+        mismatches = []
+        started = perf_counter()
+        for _ in range(repeat):
+            for source in sources.values():
+                tokens, _ = tokenizer_type(source, logger).tokenize()
+                tokens_count += len(tokens)
+        elapsed = perf_counter() - started
+
+        streams = {name: [(t.type, t.span.begin, t.value) for t in tokenizer_type(source, logger).tokenize()[0]]
+                   for name, source in sources.items()}
+        if reference is None:
+            reference = streams
+        else:
+            mismatches = [name for name in sources if streams[name] != reference[name]]
+
+        results[engine] = {
+            'seconds': elapsed,
+            'tokens': tokens_count,
+            'tokens_per_second': tokens_count / elapsed if elapsed else 0.0,
+            'mismatches': mismatches,
+        }
+    return results
+
+
+def benchmark_token_memory(sources: Dict[str, str], scale: int) -> Dict[str, dict]:
+    source = '\n'.join(sources.values()) * scale
+    results = {}
+    for name in ['list', 'stream']:
+        tokenizer = tokenizers['default'](source, logger)
+        tracemalloc.start()
+        tokens, _ = tokenizer.tokenize() if name == 'list' else tokenizer.tokenize_stream()
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = {
+            'tokens': len(tokens),
+            'bytes': size,
+            'peak_bytes': peak,
+            'bytes_per_token': size / len(tokens),
+        }
+        del tokens, tokenizer
+    return results
+
+
+def benchmark_expressions(scale: int, repeat: int) -> Dict[str, dict]:
+    line = 'v{0} = a{0} + b * c - d / e ** 2 << f | g & h ^ i or not j and k < l + m + n + o\n'
+    source = ''.join(line.format(i) for i in range(scale))
+    tokens, _ = tokenizers['default'](source, logger).tokenize()
+    results = {}
+    for engine in expression_engines:
+        started = perf_counter()
+        for _ in range(repeat):
+            root = Parser(tokens, logger, expression_engine=engine).parse()
+        elapsed = perf_counter() - started
+        results[engine] = {
+            'seconds': elapsed,
+            'statements': len(root.children),
+            'tokens_per_second': len(tokens) * repeat / elapsed if elapsed else 0.0,
+        }
+    return results
+
+
+def benchmark_node_memory(scale: int) -> Dict[str, dict]:
+    source = synthetic.generate(scale * 500)
+    tokens, _ = tokenizers['default'](source, logger).tokenize()
+    tracemalloc.start()
+    root = Parser(tokens, logger).parse()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    nodes_count = count_nodes(root)
+    return {'ast': {
+        'lines': source.count('\n'),
+        'nodes': nodes_count,
+        'bytes': size,
+        'peak_bytes': peak,
+        'bytes_per_node': size / nodes_count,
+    }}
+
+
+def benchmark_arena(scale: int) -> Dict[str, dict]:
+    source = synthetic.generate(scale * 500)
+    tokens, _ = tokenizers['default'](source, logger).tokenize()
+    results = {}
+    for name in ['objects', 'arena']:
+        parse = Parser(tokens, logger).parse if name == 'objects' else Parser(tokens, logger).parse_to_arena
+        parse_seconds, _ = best_time(parse, 1)
+        tracemalloc.start()
+        tree = Parser(tokens, logger).parse() if name == 'objects' else Parser(tokens, logger).parse_to_arena()
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        started = perf_counter()
+        if name == 'objects':
+            nodes_count = count_nodes(tree)
+        else:
+            nodes_count = 0
+            first_child, next_sibling = tree.first_child, tree.next_sibling
+            stack = [0]
+            while stack:
+                index = stack.pop()
+                nodes_count += 1
+                child = first_child[index]
+                while child != -1:
+                    stack.append(child)
+                    child = next_sibling[child]
+        elapsed = perf_counter() - started
+        results[name] = {
+            'nodes': nodes_count,
+            'bytes': size,
+            'bytes_per_node': size / nodes_count,
+            'peak_bytes': peak,
+            'parse_seconds': parse_seconds,
+            'traversal_seconds': elapsed,
+        }
+        del tree
+    return results
+
+
+def benchmark_serialization(scale: int) -> Dict[str, dict]:
+    source = synthetic.generate(scale * 500)
+    started = perf_counter()
+    tokens, _ = tokenizers['default'](source, logger).tokenize()
+    arena = Parser(tokens, logger).parse_to_arena()
+    parsed = perf_counter()
+    data = serialization.dumps(source, tokens, arena)
+    dumped = perf_counter()
+    serialization.loads(data)
+    loaded = perf_counter()
+    return {
+        'parse': {'seconds': parsed - started},
+        'dump': {'seconds': dumped - parsed, 'bytes': len(data)},
+        'load': {'seconds': loaded - dumped, 'speedup': (parsed - started) / (loaded - dumped)},
+    }
+
+
+def benchmark_cfg(scale: int, repeat: int) -> Dict[str, dict]:
+    source = synthetic.generate(scale * 500)
+    tokens, _ = tokenizers['default'](source, logger).tokenize()
+    root = Parser(tokens, logger).parse()
+    results = {}
+    for name in ['statements', 'coalesced']:
+        started = perf_counter()
+        for _ in range(repeat):
+            graph = build_cfg(root, name == 'coalesced')
+        elapsed = perf_counter() - started
+        results[name] = {
+            'blocks': len(graph),
+            'edges': graph.edges_count,
+            'seconds': elapsed / repeat,
+        }
+    return results
+
+
+def best_time(action, rounds: int) -> tuple:
+    """Smallest time of the rounds and the last result, the garbage collector is off while timing like in timeit"""
+    best = None
+    for _ in range(max(rounds, 1)):
+        gc.collect()
+        gc.disable()
+        try:
+            started = perf_counter()
+            result = action()
+            elapsed = perf_counter() - started
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def benchmark_pipeline(source: str, rounds: int) -> Dict[str, dict]:
+    """Tokenizer, parser and DOT generation timed separately"""
+    tokens_seconds, (tokens, _) = best_time(lambda: tokenizers['default'](source, logger).tokenize(), rounds)
+    parse_seconds, root = best_time(lambda: Parser(tokens, logger).parse(), rounds)
+    nodes_count = count_nodes(root)
+    results = {
+        'tokenizer': {'seconds': tokens_seconds, 'tokens': len(tokens), 'tokens_per_second': len(tokens) / tokens_seconds},
+        'parser': {'seconds': parse_seconds, 'nodes': nodes_count, 'nodes_per_second': nodes_count / parse_seconds},
+    }
+    for mode in VisualizingMode:
+        visualizer = Visualizer(root, 'benchmark', source, '', logger)
+        dot_seconds, _ = best_time(lambda: visualizer.write(mode, DotWriter(StringIO(), 'benchmark')), rounds)
+        results[f'{mode.name.lower()}-dot'] = {
+            'seconds': dot_seconds, 'graph_nodes': visualizer.id, 'graph_nodes_per_second': visualizer.id / dot_seconds}
+    return results
+
+
+def random_edit(source: str, tokens: list, random: Random) -> tuple:
+    """(begin, end, new text) of a rename, number change or an arbitrary line insertion, deletion or replacement,
+    edits are drawn until the edited source compiles"""
+    lines = source.splitlines(keepends=True)
+    starts = [0]
+    for line in lines:
+        starts.append(starts[-1] + len(line))
+    candidates = [token for token in tokens if token.type in (TokenType.NAME, TokenType.NUMBER)]
+    while True:
+        choice = random.random()
+        if choice < 0.25 and candidates:
+            token = random.choice(candidates)
+            if token.type == TokenType.NUMBER:
+                text = str(random.randint(0, 10 ** random.randint(1, 6)))
+            else:
+                text = random.choice('abxyz') + 'n' * random.randint(0, 12)
+            begin, end = token.span.begin, token.span.end
+        else:
+            # lines are copied from anywhere in the source, clause headers and block openers included
+            index = random.randrange(len(lines))
+            copied = random.choice(lines)
+            if choice < 0.5:
+                begin = end = starts[index]
+                text = copied
+            elif choice < 0.75:
+                begin, end, text = starts[index], starts[index + 1], ''
+            else:
+                begin, end, text = starts[index], starts[index + 1], copied
+        edited = source[:begin] + text + source[end:]
+        try:
+            compile(edited, '<edit>', 'exec')
+        except SyntaxError:
+            continue
+        return begin, end, text
+
+
+def tree_columns(root: nodes.Root) -> tuple:
+    arena = Arena()
+    arena.append_tree(root)
+    values = [arena.values[payload] if payload >= 0 else None for payload in arena.payloads]
+    return arena.kinds, arena.begins, arena.ends, arena.first_child, arena.next_sibling, arena.fields, values
+
+
+def benchmark_incremental(source: str, edits: int, seed: int) -> Dict[str, dict]:
+    """Random edits applied with relex and reparse, every result is compared with a fresh tokenize and parse"""
+    random = Random(seed)
+    tokenizer = tokenizers['default'](source, logger, incremental=True)
+    tokens, _ = tokenizer.tokenize()
+    root = Parser(tokens, logger).parse()
+    times = {'relex': 0.0, 'tokenize': 0.0, 'reparse': 0.0, 'parse': 0.0}
+    failures = []
+    for edit in range(edits):
+        begin, end, text = random_edit(source, tokens, random)
+        source = source[:begin] + text + source[end:]
+        delta = len(text) - (end - begin)
+
+        started = perf_counter()
+        tokens, error = tokenizer.relex(tokens, TextSpan(begin, end - begin), text)
+        relexed = perf_counter()
+        expected, expected_error = tokenizers['default'](source, logger).tokenize()
+        tokenized = perf_counter()
+        times['relex'] += relexed - started
+        times['tokenize'] += tokenized - relexed
+        if [(t.type, t.span.begin, t.span.length, t.value) for t in tokens] != \
+                [(t.type, t.span.begin, t.span.length, t.value) for t in expected] or repr(error) != repr(expected_error):
+            failures.append(f'tokens after edit {edit} at {begin}')
+            tokens = expected
+            root = Parser(tokens, logger).parse()
+            continue
+
+        started = perf_counter()
+        root = Parser(tokens, logger).reparse(root, tokenizer.damaged_span, delta)
+        reparsed = perf_counter()
+        expected_root = Parser(expected, logger).parse()
+        times['reparse'] += reparsed - started
+        times['parse'] += perf_counter() - reparsed
+        if tree_columns(root) != tree_columns(expected_root):
+            failures.append(f'tree after edit {edit} at {begin}')
+            root = expected_root
+    return {
+        'lexer': {'tokens': len(tokens), 'relex_seconds': times['relex'] / edits, 'tokenize_seconds': times['tokenize'] / edits},
+        'parser': {'reparse_seconds': times['reparse'] / edits, 'parse_seconds': times['parse'] / edits},
+        'check': {'edits': edits, 'failures': failures},
+    }
+
+
+def find_regressions(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """Metrics worse than the baseline by more than threshold (a fraction), times are lower-is-better and
+    rates higher-is-better, other metrics are not compared"""
+    regressions = []
+    for name, result in results.items():
+        for key, value in result.items():
+            previous = baseline.get(name, {}).get(key)
+            if not isinstance(previous, (int, float)) or not previous or not isinstance(value, (int, float)):
+                continue
+            if key.endswith('seconds'):
+                change = value / previous - 1
+            elif key.endswith('per_second'):
+                change = previous / value - 1 if value else float('inf')
+            else:
+                continue
+            if change > threshold:
+                regressions.append(f'{name}.{key}: {previous:.4f} -> {value:.4f} ({change:+.0%})')
+    return regressions
+
+
+def print_results(title: str, results: Dict[str, dict]):
+    print(title)
+    for name, result in results.items():
+        line = ', '.join(f'{key}: {value:.4f}' if isinstance(value, float) else f'{key}: {value}' for key, value in result.items())
+        print(f'  {name:<12} {line}')
+
+
+def main():
+    arg_parser = ArgumentParser(description='Benchmarks for the AST builder/visualizer')
+    arg_parser.add_argument('suite', nargs='?', default='lexer', choices=['lexer', 'token-memory', 'expressions', 'node-memory', 'arena', 'serialization', 'cfg', 'pipeline', 'incremental'])
+    arg_parser.add_argument('files', nargs='*', default=sorted(glob('testdata/*.py')))
+    arg_parser.add_argument('-r', '--repeat', type=int, default=200)
+    arg_parser.add_argument('-s', '--scale', type=int, default=100)
+    arg_parser.add_argument('--lines', type=int, help='pipeline (20000 by default), incremental (2000 by default): synthetic source lines')
+    arg_parser.add_argument('--depth', type=int, default=2, help='pipeline: block nesting depth')
+    arg_parser.add_argument('--width', type=int, default=4, help='pipeline: operands per expression')
+    arg_parser.add_argument('--literal-density', type=float, default=0.3, help='pipeline: share of literal operands')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--rounds', type=int, default=3, help='pipeline: best of this many runs')
+    arg_parser.add_argument('--json', help='write the results to this file')
+    arg_parser.add_argument('--baseline', help='results file to compare with, exits with 1 on regressions')
+    arg_parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown against the baseline')
+    args = arg_parser.parse_args()
+
+    sources = read_sources(args.files)
+    if args.suite == 'lexer':
+        title, results = 'Tokenizer engines', benchmark_tokenizers({**sources, **engine_differences}, args.repeat)
+    elif args.suite == 'token-memory':
+        title, results = 'Token storage', benchmark_token_memory(sources, args.scale)
+    elif args.suite == 'expressions':
+        title, results = 'Expression engines', benchmark_expressions(args.scale, args.repeat)
+    elif args.suite == 'node-memory':
+        title, results = 'AST memory', benchmark_node_memory(args.scale)
+    elif args.suite == 'arena':
+        title, results = 'AST storage', benchmark_arena(args.scale)
+    elif args.suite == 'serialization':
+        title, results = 'Serialized parse', benchmark_serialization(args.scale)
+    elif args.suite == 'cfg':
+        title, results = 'Control flow graph', benchmark_cfg(args.scale, args.repeat)
+    elif args.suite == 'incremental':
+        source = synthetic.generate(args.lines or 2000, args.depth, args.width, args.literal_density, args.seed)
+        title, results = 'Incremental relex and reparse', benchmark_incremental(source, args.repeat, args.seed)
+    else:
+        source = synthetic.generate(args.lines or 20000, args.depth, args.width, args.literal_density, args.seed)
+        title, results = 'Pipeline', benchmark_pipeline(source, args.rounds)
+    print_results(title, results)
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump({'suite': args.suite, 'arguments': vars(args), 'results': results}, output, indent=2)
+    failures = [failure for result in results.values() for failure in result.get('failures', ())]
+    if failures:
+        print(f'{len(failures)} results differ from a fresh tokenize and parse')
+        raise SystemExit(1)
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline:
+            regressions = find_regressions(results, json.load(baseline)['results'], args.threshold)
+        if regressions:
+            print(f'Regressions over {args.threshold:.0%}:')
+            for regression in regressions:
+                print(f'  {regression}')
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+from enum import Enum
+from typing import Dict, Iterator, List, Set, Tuple
+import nodes
+from visitor import NodeVisitor
+
+
+class BlockKind(Enum):
+    ENTRY = 0
+    STATEMENTS = 1
+    IF = 2
+    FOR = 3
+    WHILE = 4
+    DEFINITION = 5
+    RETURN = 6
+    BREAK = 7
+    CONTINUE = 8
+
+
+class EdgeKind(Enum):
+    NEXT = 0
+    TRUE = 1
+    FALSE = 2
+    LOOP_ENTRY = 3
+    ITERATION = 4
+    DEFINITION = 5
+
+
+class BasicBlock:
+    """Statements executed one after another
+
+    IF, FOR and WHILE blocks hold the condition or the iterator, function is the definition a RETURN block exits from.
+    """
+    __slots__ = ('id', 'kind', 'statements', 'successors', 'predecessors', 'function')
+
+    def __init__(self, id: int, kind: BlockKind, statements: List[nodes.Node],
+                 function: nodes.DefinitionStatement = None) -> None:
+        self.id = id
+        self.kind = kind
+        self.statements = statements
+        self.successors: Dict[int, EdgeKind] = {}
+        self.predecessors: Set[int] = set()
+        self.function = function
+
+    def __str__(self) -> str:
+        return f'{self.kind.name} {self.id} -> {list(self.successors)}'
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
+
+class ControlFlowGraph:
+    """Basic blocks with adjacency sets, block 0 is the entry. There is at most one edge between two blocks."""
+
+    def __init__(self) -> None:
+        self.blocks: List[BasicBlock] = []
+
+    def add_block(self, kind: BlockKind, statements: List[nodes.Node], function: nodes.DefinitionStatement = None) -> int:
+        block = BasicBlock(len(self.blocks), kind, statements, function)
+        self.blocks.append(block)
+        return block.id
+
+    def add_edge(self, tail: int, head: int, kind: EdgeKind = EdgeKind.NEXT):
+        successors = self.blocks[tail].successors
+        if head not in successors:
+            successors[head] = kind
+            self.blocks[head].predecessors.add(tail)
+
+    def edges(self) -> Iterator[Tuple[int, int, EdgeKind]]:
+        for block in self.blocks:
+            for head, kind in block.successors.items():
+                yield block.id, head, kind
+
+    @property
+    def edges_count(self) -> int:
+        return sum(len(block.successors) for block in self.blocks)
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+
+# blocks whose outgoing edge goes to the next statement, with the kind of that edge
+Exits = List[Tuple[int, EdgeKind]]
+
+
+class CfgBuilder(NodeVisitor):
+    """Builds the graph in one pass over the statements, keeping the pending exits of the current statement
+
+    With coalesce, straight-line runs of simple statements are merged into one STATEMENTS block.
+    """
+
+    def __init__(self, coalesce: bool = False) -> None:
+        self.graph = ControlFlowGraph()
+        self.coalesce = coalesce
+        # loop header and the exits of its break statements
+        self.loops: List[Tuple[int, Exits]] = []
+        self.functions: List[nodes.DefinitionStatement] = []
+
+    def build(self, root: nodes.Root) -> ControlFlowGraph:
+        entry = self.graph.add_block(BlockKind.ENTRY, [root])
+        self.statements(root.children, [(entry, EdgeKind.NEXT)])
+        return self.graph
+
+    def block(self, kind: BlockKind, statements: List[nodes.Node], exits: Exits) -> int:
+        block = self.graph.add_block(kind, statements, self.functions[-1] if kind == BlockKind.RETURN and self.functions else None)
+        self.connect(exits, block)
+        return block
+
+    def connect(self, exits: Exits, head: int, kind: EdgeKind = None):
+        for tail, exit_kind in exits:
+            self.graph.add_edge(tail, head, kind if kind and exit_kind == EdgeKind.NEXT else exit_kind)
+
+    def statements(self, statements: List[nodes.Node], exits: Exits) -> Exits:
+        for statement in statements:
+            if statement is not None:
+                exits = self.visit(statement, exits)
+        return exits
+
+    def visit_BlockStatement(self, node: nodes.BlockStatement, exits: Exits) -> Exits:
+        return self.statements(node.children, exits)
+
+    def visit_ForStatement(self, node: nodes.ForStatement, exits: Exits) -> Exits:
+        return self.loop(BlockKind.FOR, node.iterator, node.block, exits)
+
+    def visit_WhileStatement(self, node: nodes.WhileStatement, exits: Exits) -> Exits:
+        return self.loop(BlockKind.WHILE, node.condition, node.block, exits)
+
+    def visit_ReturnStatement(self, node: nodes.ReturnStatement, exits: Exits) -> Exits:
+        self.block(BlockKind.RETURN, [node], exits)
+        return []
+
+    def visit_Terminal(self, node: nodes.Terminal, exits: Exits) -> Exits:
+        if self.loops and node.value in ('break', 'continue'):
+            return self.jump(node, exits)
+        return self.generic_visit(node, exits)
+
+    def generic_visit(self, node: nodes.Node, exits: Exits) -> Exits:
+        """Simple statement"""
+        if self.coalesce and len(exits) == 1:
+            tail, kind = exits[0]
+            block = self.graph.blocks[tail]
+            if kind == EdgeKind.NEXT and block.kind == BlockKind.STATEMENTS:
+                block.statements.append(node)
+                return exits
+        return [(self.block(BlockKind.STATEMENTS, [node], exits), EdgeKind.NEXT)]
+
+    def visit_IfElseStatement(self, node: nodes.IfElseStatement, exits: Exits) -> Exits:
+        condition = self.block(BlockKind.IF, [node.condition], exits)
+        true_exits = self.visit(node.true_branch, [(condition, EdgeKind.TRUE)])
+        if node.false_branch is None:
+            return true_exits + [(condition, EdgeKind.FALSE)]
+        return true_exits + self.visit(node.false_branch, [(condition, EdgeKind.FALSE)])
+
+    def loop(self, kind: BlockKind, header_node: nodes.Node, body: nodes.Node, exits: Exits) -> Exits:
+        header = self.block(kind, [header_node], exits)
+        self.loops.append((header, []))
+        body_exits = self.visit(body, [(header, EdgeKind.LOOP_ENTRY)])
+        self.connect(body_exits, header, EdgeKind.ITERATION)
+        _, breaks = self.loops.pop()
+        return [(header, EdgeKind.NEXT)] + breaks
+
+    def jump(self, node: nodes.Terminal, exits: Exits) -> Exits:
+        header, breaks = self.loops[-1]
+        if node.value == 'break':
+            breaks.append((self.block(BlockKind.BREAK, [node], exits), EdgeKind.NEXT))
+        else:
+            self.graph.add_edge(self.block(BlockKind.CONTINUE, [node], exits), header, EdgeKind.ITERATION)
+        return []
+
+    def visit_DefinitionStatement(self, node: nodes.DefinitionStatement, exits: Exits) -> Exits:
+        definition = self.block(BlockKind.DEFINITION, [node], exits)
+        loops, self.loops = self.loops, []
+        self.functions.append(node)
+        self.visit(node.body, [(definition, EdgeKind.DEFINITION)])
+        self.functions.pop()
+        self.loops = loops
+        return [(definition, EdgeKind.NEXT)]
+
+
+def build_cfg(root: nodes.Root, coalesce: bool = False) -> ControlFlowGraph:
+    return CfgBuilder(coalesce).build(root)
@@ -1,3 +1,7 @@
+from typing import Dict, List
+from text_span import TextSpan
+
+
 class LexingError(Exception):
     def __init__(self, ex: Exception = None, index: int = 0, msg=''):
         self.original = ex
@@ -12,3 +16,44 @@ class ParsingError(Exception):
         self.index = index
         self.msg = f'ParsingError ({repr(ex) + ": " + msg if ex else msg}) at position: {self.index}'
         super().__init__(self.msg)
+
+
+class SerializationError(Exception):
+    def __init__(self, ex: Exception = None, index: int = 0, msg=''):
+        self.original = ex
+        self.index = index
+        self.msg = f'SerializationError ({repr(ex) + ": " + msg if ex else msg}) at position: {self.index}'
+        super().__init__(self.msg)
+
+
+class Diagnostic:
+    def __init__(self, kind: str, span: TextSpan, msg: str = '') -> None:
+        self.kind = kind
+        self.span = span
+        self.msg = msg
+
+    def __str__(self) -> str:
+        return f'{self.kind} at {self.span}{": " + self.msg if self.msg else ""}'
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
+
+class Diagnostics:
+    """Problems collected while parsing in recovery mode, counted by kind, only the first `limit` are kept"""
+
+    def __init__(self, limit: int = 1000) -> None:
+        self.limit = limit
+        self.counts: Dict[str, int] = {}
+        self.items: List[Diagnostic] = []
+
+    def add(self, kind: str, span: TextSpan, msg: str = ''):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        if len(self.items) < self.limit:
+            self.items.append(Diagnostic(kind, span, msg))
+
+    def summary(self) -> str:
+        return ', '.join(f'{kind}: {count}' for kind, count in sorted(self.counts.items(), key=lambda item: -item[1]))
+
+    def __len__(self) -> int:
+        return sum(self.counts.values())
@@ -0,0 +1,100 @@
+import gzip
+import os
+import re
+from typing import TextIO, Union
+
+try:
+    import graphviz
+except ImportError:
+    graphviz = None
+
+ID = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*|-?(\.[0-9]+|[0-9]+(\.[0-9]*)?))$')
+KEYWORDS = {'node', 'edge', 'graph', 'digraph', 'subgraph', 'strict'}
+
+
+def quote(identifier: str) -> str:
+    """DOT identifier for the text, backslashes and quotes are escaped so that labels show the text as is"""
+    if ID.match(identifier) and identifier.lower() not in KEYWORDS:
+        return identifier
+    return '"' + identifier.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def attributes(attrs: dict) -> str:
+    """DOT attribute list, the label goes first like in graphviz output"""
+    items = sorted(attrs.items(), key=lambda item: item[0] != 'label')
+    return ' '.join(f'{quote(key)}={quote(value)}' for key, value in items if value is not None)
+
+
+class GraphSink:
+    """Receives the nodes and edges of a graph in the order the visualizer produces them"""
+
+    def node(self, key: str, label: str, **attrs):
+        raise NotImplementedError()
+
+    def edge(self, tail: str, head: str, **attrs):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class GraphvizSink(GraphSink):
+    """Collects the graph into a graphviz.Digraph, needs the graphviz package"""
+
+    def __init__(self, name: str) -> None:
+        if graphviz is None:
+            raise ImportError('graphviz package is not installed, use DotWriter to produce DOT files without it')
+        self.graph = graphviz.Digraph(name)
+
+    def node(self, key: str, label: str, **attrs):
+        self.graph.node(key, graphviz.escape(label), **attrs)
+
+    def edge(self, tail: str, head: str, **attrs):
+        self.graph.edge(tail, head, **attrs)
+
+    @property
+    def source(self) -> str:
+        return self.graph.source
+
+    def render(self, path: str, engine: str = 'dot'):
+        self.graph.render(path, engine=engine)
+
+
+class DotWriter(GraphSink):
+    """Writes DOT statements as soon as they are produced
+
+    target is a file name (gzip compressed when it ends with .gz) or an open text stream which is left open.
+    """
+
+    def __init__(self, target: Union[str, TextIO], name: str) -> None:
+        if isinstance(target, str):
+            directory = os.path.dirname(target)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.stream = gzip.open(target, 'wt', encoding='utf-8') if target.endswith('.gz') \
+                else open(target, 'w', encoding='utf-8')
+        else:
+            self.stream = target
+        self.owns_stream = isinstance(target, str)
+        self.nodes = 0
+        self.edges = 0
+        self.closed = False
+        self.stream.write(f'digraph {quote(name)} {{\n')
+
+    def node(self, key: str, label: str, **attrs):
+        line = attributes({'label': label, **attrs})
+        self.stream.write(f'\t{quote(key)} [{line}]\n')
+        self.nodes += 1
+
+    def edge(self, tail: str, head: str, **attrs):
+        line = attributes(attrs)
+        self.stream.write(f'\t{quote(tail)} -> {quote(head)}{" [" + line + "]" if line else ""}\n')
+        self.edges += 1
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.stream.write('}\n')
+        if self.owns_stream:
+            self.stream.close()
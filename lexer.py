@@ -1,12 +1,19 @@
 from logging import Logger
-from text_span import TextSpan
+from text_span import TextSpan, source_text
 from errors import LexingError
-from typing import Tuple, List
+from typing import Deque, Iterator, Tuple, List
+from collections import deque
+from weakref import WeakSet
+from bisect import bisect_left, bisect_right
 import re
+import mmap
 from lexer_utils import TokenType, punctuators, operators, keywords
+from token_stream import TokenStream
 
 
 class Token:
+    __slots__ = ('type', 'value', 'span')
+
     def __init__(self, token_type: int, value: str, position: int):
         self.type = token_type
         self.value = value
@@ -20,6 +27,106 @@ class Token:
         return self.__str__()
 
 
+class LazyToken(Token):
+    """Token that keeps only its offsets, the text is sliced from the source on first access"""
+    __slots__ = ('source', '_value')
+
+    def __init__(self, token_type: int, source, position: int, length: int):
+        self.type = token_type
+        self.source = source
+        self.span = TextSpan(position, length)
+        self._value = None
+
+    @property
+    def value(self) -> str:
+        if self._value is None:
+            self._value = source_text(self.source, self.span.begin, self.span.end)
+        return self._value
+
+
+class Shifts:
+    """Moves of the offsets of one lexing run made by the edits that followed it
+
+    Steps of (first offset in the text of the run, delta), relex() records an edit here once instead
+    of moving every token after it. limit is the end of the lexed part of the run, edits after it add no steps.
+    """
+    __slots__ = ('offsets', 'deltas', 'limit', '__weakref__')
+
+    def __init__(self) -> None:
+        self.offsets = [0]
+        self.deltas = [0]
+        self.limit = None
+
+    def at(self, offset: int) -> int:
+        return self.deltas[bisect_right(self.offsets, offset) - 1]
+
+    def move(self, position: int, delta: int):
+        """Moves the offsets that are at position of the current text or after it by delta"""
+        offsets = []
+        deltas = []
+        count = len(self.offsets)
+        for index in range(count):
+            begin = self.offsets[index]
+            shift = self.deltas[index]
+            split = max(begin, position - shift)
+            end = self.offsets[index + 1] if index + 1 < count else self.limit
+            if end is not None and split >= end:
+                steps = ((begin, shift),)
+            elif split > begin:
+                steps = ((begin, shift), (split, shift + delta))
+            else:
+                steps = ((begin, shift + delta),)
+            for step_begin, step_delta in steps:
+                if not deltas or deltas[-1] != step_delta:
+                    offsets.append(step_begin)
+                    deltas.append(step_delta)
+        self.offsets = offsets
+        self.deltas = deltas
+
+
+class AnchoredToken(Token):
+    """Token of an incremental tokenizer
+
+    The span is kept in the coordinates of the text the token was lexed from and moved by shifts when it is read,
+    values of lazy tokens are sliced from the LiveSource.
+    """
+    __slots__ = ('origin', 'shifts', 'source', '_value')
+
+    def __init__(self, token_type: int, shifts: Shifts, position: int, length: int, value: str = None, source = None):
+        self.type = token_type
+        self.origin = TextSpan(position, length)
+        self.shifts = shifts
+        self.source = source
+        self._value = value
+
+    @property
+    def span(self) -> TextSpan:
+        origin = self.origin
+        delta = self.shifts.at(origin.begin)
+        return TextSpan(origin.begin + delta, origin.length) if delta else origin
+
+    @property
+    def value(self) -> str:
+        if self._value is None and self.source is not None:
+            span = self.span
+            self._value = source_text(self.source, span.begin, span.end)
+        return self._value
+
+
+class LiveSource:
+    """Current text of an incremental tokenizer, relex() replaces it for all lazy tokens at once"""
+    __slots__ = ('text',)
+
+    def __init__(self, text) -> None:
+        self.text = text
+
+    def __getitem__(self, key):
+        return self.text[key]
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+
 trailing_tokens = [' ', '\r', '\t']
 quotes = ['\'', '\"']
 
@@ -33,60 +140,213 @@ class Tokenizer:
 
     @property
     def _last_token(self) -> Token:
-        return self._tokens[-1] if len(self._tokens) > 0 else None
+        return self._last
 
-    def __init__(self, text: str, logger: Logger):
+    def __init__(self, text: str, logger: Logger, lazy: bool = False, incremental: bool = False):
         self.text = text
+        self.lazy = lazy
         self._index = 0
         self._text_len = len(text)
         self._indents = []
+        self._indents_snapshot: Tuple[int] = ()
         self._tokens: List[Token] = []
+        self._pending: Deque[Token] = deque()
+        self._last: Token = None
         self.logger = logger
+        # NEWLINE tokens (their ends are line starts) with the indents stack at each line start, needed by relex()
+        self._lines: List[Token] = [] if incremental else None
+        self._line_indents: List[Tuple[int]] = [] if incremental else None
+        # incremental tokens are anchored to the shifts of the run that lexed them
+        self._shifts = Shifts() if incremental else None
+        self._runs = WeakSet([self._shifts]) if incremental else None
+        self._live = LiveSource(text) if incremental else None
+        self.damaged_span: TextSpan = None
 
     def tokenize(self) -> Tuple[List[Token], LexingError]:
-        error: LexingError = None
-        while self._index < self._text_len:
-            _, error = self.try_get_next_token()
+        self._tokens = []
+        try:
+            self._tokens.extend(self.iter_tokens())
+        except LexingError as error:
+            self.logger.error(error.msg)
+            return (self._tokens, error)
+        return (self._tokens, None)
 
-            if error is not None:
-                self.logger.error(error.msg)
-                return (self._tokens, error)
+    def tokenize_stream(self) -> Tuple[TokenStream, LexingError]:
+        stream = TokenStream(self.text)
+        try:
+            stream.extend(self.iter_tokens())
+        except LexingError as error:
+            self.logger.error(error.msg)
+            return (stream, error)
+        return (stream, None)
 
-        if self._tokens[-1].type != TokenType.EOF:
+    def iter_tokens(self) -> Iterator[Token]:
+        pending = self._pending
+        while self._index < self._text_len:
+            try:
+                self.next_token()
+            except LexingError:
+                raise
+            except Exception as ex:
+                raise LexingError(ex, self._index)
+            while pending:
+                yield pending.popleft()
+
+        if self._last is None or self._last.type != TokenType.EOF:
             self.handle_indenting()
-            self._tokens.append(Token(TokenType.EOF, None, self._text_len))
-        return (self._tokens, error)
-
-    def try_get_next_token(self) -> Tuple[Token, LexingError]:
+            self.emit(self.marker_token(TokenType.EOF, None, self._text_len))
+        while pending:
+            yield pending.popleft()
+
+    def relex(self, old_tokens: List[Token], edit_span: TextSpan, new_text: str) -> Tuple[List[Token], LexingError]:
+        """Replaces edit_span of the current text with new_text and lexes only the affected lines
+
+        Lexing restarts at the last line boundary before the edit and stops at the first line start
+        after it where the indents stack matches the old one. The relexed tokens are spliced into
+        old_tokens in place and the rest of them is reused untouched: the edit is recorded once in
+        the shifts of the earlier runs, which move token spans when they are read. old_tokens is
+        consumed, the returned list is the same object. The relexed region (in old coordinates) is
+        stored in damaged_span.
+        """
+        old_text = self.text
+        text = old_text[:edit_span.begin] + new_text + old_text[edit_span.end:]
+        delta = len(new_text) - edit_span.length
+        old_lines = self._lines
+        old_indents = self._line_indents
+
+        # a stream cut by a lexing error has no usable tail
+        complete = len(old_tokens) > 0 and old_tokens[-1].type == TokenType.EOF
+        line = bisect_right(old_lines, edit_span.begin, key=line_start) - 1 if old_lines is not None and complete else -1
+        restart_token = bisect_left(old_tokens, old_lines[line].span.begin, key=token_begin) if line >= 0 else 0
+        if line < 0 or restart_token >= len(old_tokens) or old_tokens[restart_token].type != TokenType.NEWLINE:
+            return self.retokenize(text)
+
+        # restart from the NEWLINE that opens the line so both engines handle its indentation
+        restart = old_lines[line].span.begin
+        runs = list(self._runs)
+        self._shifts = Shifts()
+        self._runs.add(self._shifts)
+        self.text = text
+        self._live.text = text
+        self._text_len = len(text)
+        self._index = restart
+        self._indents = list(old_indents[line])
+        self._indents_snapshot = old_indents[line]
+        self._last = old_tokens[restart_token - 1] if restart_token > 0 else None
+        self._pending.clear()
+        self._lines = []
+        self._line_indents = []
+
+        tokens = []
+        edit_end = edit_span.begin + len(new_text)
+        old_end = len(old_text)
+        # ends of the replaced token and line ranges, everything after them is reused
+        tail = len(old_tokens)
+        tail_line = len(old_lines)
+        error = None
         try:
-            self.next_token()
-            return (self._last_token, None)
-        except LexingError as error:
-            return (None, error)
-        except Exception as ex:
-            return (None, LexingError(ex, self._index))
+            for token in self.iter_tokens():
+                tokens.append(token)
+                if token.type != TokenType.NEWLINE or token.span.end < edit_end:
+                    continue
+                old_start = token.span.end - delta
+                old_line = bisect_left(old_lines, old_start, key=line_start)
+                if old_line < len(old_lines) and line_start(old_lines[old_line]) == old_start \
+                        and old_indents[old_line] == tuple(self._indents):
+                    old_end = old_start
+                    tail = bisect_left(old_tokens, old_start, key=token_begin)
+                    # the line states after the resynchronizing line are the old ones
+                    tail_line = old_line + 1
+                    self._index = self._text_len
+                    self._indents = []
+                    self._indents_snapshot = ()
+                    break
+        except LexingError as lexing_error:
+            self.logger.error(lexing_error.msg)
+            error = lexing_error
+
+        if tokens:
+            self._shifts.limit = tokens[-1].origin.end
+        # tokens of the earlier runs after the edit follow it, whether they are reused or not
+        for shifts in runs:
+            shifts.move(edit_span.end, delta)
+        reused = tail < len(old_tokens)
+        old_tokens[restart_token: tail] = tokens
+        old_lines[line: tail_line] = self._lines
+        old_indents[line: tail_line] = self._line_indents
+        self._lines = old_lines
+        self._line_indents = old_indents
+        if reused:
+            self._last = old_tokens[-1]
+        self.damaged_span = TextSpan(restart, old_end - restart)
+        self._tokens = old_tokens
+        return (old_tokens, error)
+
+    def retokenize(self, text: str) -> Tuple[List[Token], LexingError]:
+        self.text = text
+        self._text_len = len(text)
+        self._index = 0
+        self._indents = []
+        self._indents_snapshot = ()
+        self._last = None
+        self._pending.clear()
+        if self._lines is not None:
+            self._lines = []
+            self._line_indents = []
+            self._shifts = Shifts()
+            self._runs = WeakSet([self._shifts])
+            self._live = LiveSource(text)
+        self.damaged_span = TextSpan(0, self._text_len)
+        return self.tokenize()
+
+    def mark_line_start(self, newline: Token):
+        if self._indents_snapshot is None:
+            self._indents_snapshot = tuple(self._indents)
+        self._lines.append(newline)
+        self._line_indents.append(self._indents_snapshot)
+
+    def make_token(self, token_type: TokenType, position: int, end: int, value: str = None) -> Token:
+        """Token of text[position:end], value is passed when the caller already has the text"""
+        if self._shifts is not None:
+            if self.lazy:
+                return AnchoredToken(token_type, self._shifts, position, end - position, None, self._live)
+            return AnchoredToken(token_type, self._shifts, position, end - position,
+                                 value if value is not None else self.text[position: end])
+        if self.lazy:
+            return LazyToken(token_type, self.text, position, end - position)
+        return Token(token_type, value if value is not None else self.text[position: end], position)
+
+    def marker_token(self, token_type: TokenType, value: str, position: int) -> Token:
+        """INDENT, DEDENT and EOF tokens"""
+        if self._shifts is not None:
+            return AnchoredToken(token_type, self._shifts, position, 0, value)
+        return Token(token_type, value, position)
+
+    def emit(self, token: Token):
+        self._pending.append(token)
+        self._last = token
 
     def next_token(self):
         current_symbol = None
-        last = self._last_token
+        last = self._last
         if last and last.type == TokenType.NEWLINE:
-            line = take_symbols_until(self.text[self._index:], '\n')
-            for s in line:
-                if s not in trailing_tokens:
-                    self.handle_indenting()
-                    break
-            self.skip_trailing()
-            current_symbol = self.text[self._index]
+            if not self.is_blank_line():
+                self.handle_indenting()
+            current_symbol = self.skip_trailing()
+            if current_symbol is None:
+                return
         else:
             current_symbol = self.skip_trailing()
             if current_symbol is None:
                 self.handle_indenting()
-                self._tokens.append(Token(TokenType.EOF, None, self._text_len))
+                self.emit(self.marker_token(TokenType.EOF, None, self._text_len))
                 return
         token = None
 
         if current_symbol == '\n':
-            token = Token(TokenType.NEWLINE, current_symbol, self._index)
+            token = self.make_token(TokenType.NEWLINE, self._index, self._index + 1, current_symbol)
+            if self._lines is not None:
+                self.mark_line_start(token)
         elif current_symbol.isalpha() or current_symbol == '_':
             token = self.next_keyword_string_name()
         elif current_symbol.isnumeric():
@@ -98,22 +358,34 @@ class Tokenizer:
         else:
             token = self.next_operator_punctuator()
 
-        self._tokens.append(token)
+        self.emit(token)
         self._index += token.span.length
 
+    def is_blank_line(self) -> bool:
+        # look only at the leading whitespace of the current line instead of slicing the rest of the text
+        index = self._index
+        while index < self._text_len:
+            symbol = self.text[index]
+            if symbol == '\n':
+                return True
+            if symbol not in trailing_tokens:
+                return False
+            index += 1
+        return True
+
     def next_keyword_string_name(self) -> Token:
         next_ = self.get_next_symbol()
         if next_ and next_ in quotes:
             return self.next_string()
 
-        token_text = self.get_token_text(keyword_or_name_regex)
-        # Can be replaced by token_text.iskeyword()
-        token_type = keywords.get(token_text, None)
-
-        if token_type:
-            return Token(token_type, token_text, self._index)
-        else:
-            return Token(TokenType.NAME, token_text, self._index)
+        end = self.get_token_end(keyword_or_name_regex)
+        token_type = TokenType.NAME
+        token_text = None
+        # longer names can't be keywords, they are not sliced in the lazy mode
+        if end - self._index <= longest_keyword:
+            token_text = self.text[self._index: end]
+            token_type = keywords.get(token_text, TokenType.NAME)
+        return self.make_token(token_type, self._index, end, token_text)
 
     def next_string(self) -> Token:
         quote = None
@@ -129,17 +401,17 @@ class Tokenizer:
                 quote = current
             current_index += 1
 
-        text_value = self.text[self._index: current_index + 1]
-        return Token(TokenType.STRING, text_value, self._index)
+        return self.make_token(TokenType.STRING, self._index, min(current_index + 1, self._text_len))
 
     def next_number(self) -> Token:
-        token_text = self.get_token_text(number_regex)
-        return Token(TokenType.NUMBER, token_text, self._index)
+        return self.make_token(TokenType.NUMBER, self._index, self.get_token_end(number_regex))
 
     def next_comment(self) -> Token:
-        token_text = self.get_token_text(comment_regex)
+        end = self.get_token_end(comment_regex)
         # remove trailing control characters
-        return Token(TokenType.COMMENT, token_text.rstrip(), self._index)
+        while end > self._index and self.text[end - 1].isspace():
+            end -= 1
+        return self.make_token(TokenType.COMMENT, self._index, end)
 
     def next_operator_punctuator(self) -> Token:
         token_text = self.get_token_text(operator_punctuator_regex)
@@ -150,7 +422,7 @@ class Tokenizer:
             raise LexingError(index=self._index,
                               msg='Unexpected operator or punctuator')
 
-        return Token(token_type, token_text, self._index)
+        return self.make_token(token_type, self._index, self._index + len(token_text), token_text)
 
     def handle_indenting(self):
         indent_level = 0
@@ -162,16 +434,20 @@ class Tokenizer:
                 indent_level += 4
             self._index += 1
             current_symbol = self.text[self._index] if self._index < self._text_len else None
+        self.update_indents(indent_level)
 
+    def update_indents(self, indent_level: int):
         previous_indent = self._indents[-1] if len(self._indents) > 0 else 0
 
         if indent_level > previous_indent:
             self._indents.append(indent_level)
-            self._tokens.append(Token(TokenType.INDENT, '', 0))
+            self._indents_snapshot = None
+            self.emit(self.marker_token(TokenType.INDENT, '', self._index))
         else:
             while len(self._indents) > 0 and self._indents[-1] > indent_level:
-                self._tokens.append(Token(TokenType.DEDENT, '', 0))
+                self.emit(self.marker_token(TokenType.DEDENT, '', self._index))
                 self._indents.pop()
+                self._indents_snapshot = None
 
     def skip_trailing(self):
         current = self.text[self._index]
@@ -182,10 +458,13 @@ class Tokenizer:
             current = self.text[self._index]
         return current
 
-    def get_token_text(self, regex: re.Pattern) -> Token:
+    def get_token_text(self, regex: re.Pattern) -> str:
         match: re.Match = regex.search(self.text, self._index)
         return self.text[match.start(): match.end()]
 
+    def get_token_end(self, regex: re.Pattern) -> int:
+        return regex.search(self.text, self._index).end()
+
     def get_next_symbol(self) -> str:
         return self.get_symbol(self._index + 1)
 
@@ -199,6 +478,138 @@ class Tokenizer:
         return self.text[index] if index < self._text_len else None
 
 
+class ScannerTokenizer(Tokenizer):
+    """Single pass engine: one anchored master regex instead of per symbol dispatch
+
+    It follows Python where the default engine does not:
+    - two letter string prefixes (rb"a") are a part of the STRING token, the default engine lexes NAME rb and STRING "a"
+    - triple-quoted strings are one STRING token, the default engine splits them into "" "..." "" tokens
+    - a backslash continues the line, the default engine raises LexingError on it
+    """
+
+    def __init__(self, text: str, logger: Logger, lazy: bool = False, incremental: bool = False):
+        binary = not isinstance(text, str)
+        # bytes like sources (e.g. mmap) are lexed by offsets and decoded only when a value is read
+        super().__init__(text, logger, lazy or binary, incremental)
+        self.tables = bytes_scanner_tables if binary else scanner_tables
+
+    def iter_tokens(self) -> Iterator[Token]:
+        text = self.text
+        tables = self.tables
+        keywords_table = tables.keywords
+        operators_table = tables.operators
+        newline = tables.newline
+        pending = self._pending
+        last = None
+        make_token = self.make_token
+        position = self._index
+        match = tables.regex.scanner(text, position).match
+        for m in iter(match, None):
+            kind = m.lastgroup
+            position = m.start()
+            if kind == 'WHITESPACE':
+                continue
+            if kind == 'NAME':
+                end = m.end()
+                if end - position <= longest_keyword:
+                    value = m.group()
+                    last = make_token(keywords_table.get(value, TokenType.NAME), position, end, value)
+                else:
+                    last = make_token(TokenType.NAME, position, end)
+            elif kind == 'OPERATOR':
+                value = m.group()
+                last = make_token(operators_table[value], position, m.end(), value)
+            elif kind == 'NEWLINE':
+                last = make_token(TokenType.NEWLINE, position, position + 1, '\n')
+                if self._lines is not None:
+                    self.mark_line_start(last)
+                yield last
+                self._index = m.end()
+                if self._index < self._text_len and text[self._index: self._index + 1] != newline:
+                    leading = m.group('LEADING')
+                    self.update_indents(leading.count(tables.space) + leading.count(tables.tab) * 4)
+                    while pending:
+                        last = pending.popleft()
+                        yield last
+                continue
+            elif kind == 'NUMBER':
+                last = make_token(TokenType.NUMBER, position, m.end())
+            elif kind == 'STRING':
+                last = make_token(TokenType.STRING, position, m.end())
+            elif kind == 'COMMENT':
+                last = make_token(TokenType.COMMENT, position, m.end('COMMENT'))
+            else:
+                self._index = position
+                raise LexingError(index=position, msg='Unexpected symbol')
+            yield last
+
+        self._index = self._text_len
+        self.update_indents(0)
+        self.emit(self.marker_token(TokenType.EOF, None, self._text_len))
+        while pending:
+            yield pending.popleft()
+
+
+class ScannerTables:
+    def __init__(self, regex: re.Pattern, keywords: dict, operators: dict, newline, space, tab) -> None:
+        self.regex = regex
+        self.keywords = keywords
+        self.operators = operators
+        self.newline = newline
+        self.space = space
+        self.tab = tab
+
+
+def build_master_pattern(name_pattern: str = r'[^\W\d]\w*') -> str:
+    operator_punctuator = '|'.join(map(re.escape, sorted(operators_punctuators, key=len, reverse=True)))
+    return '|'.join([
+        r'(?P<WHITESPACE>(?:[ \t\r]|\\\r?\n)+)',
+        r'(?P<NEWLINE>\n(?P<LEADING>[ \t\r]*))',
+        # trailing whitespace is matched with the comment but left out of the token
+        r'(?P<COMMENT>\#(?:[^\r\n\f]*\S)?)[^\S\r\n\f]*',
+        r'(?P<STRING>(?:[rRbBuUfF]{1,2})?(?:\'\'\'(?:[^\\]|\\[\s\S])*?\'\'\'|"""(?:[^\\]|\\[\s\S])*?"""'
+        r'|\'(?:[^\'\\\n]|\\[\s\S])*\'|"(?:[^"\\\n]|\\[\s\S])*"))',
+        f'(?P<NAME>{name_pattern})',
+        r'(?P<NUMBER>(?:0(?:[0_]+|[bB][01_]+|[oO][0-7_]+|[xX][0-9a-fA-F_]+)?|[1-9][0-9_]*)(?:\.\d+)?)',
+        f'(?P<OPERATOR>{operator_punctuator})',
+        r'(?P<ERROR>.)',
+    ])
+
+
+def map_source_file(file_name: str):
+    with open(file_name, 'rb') as file:
+        try:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped
+            return b''
+
+
+operators_punctuators = {**operators, **punctuators}
+longest_keyword = max(map(len, keywords))
+master_regex: re.Pattern = re.compile(build_master_pattern())
+scanner_tables = ScannerTables(master_regex, keywords, operators_punctuators, '\n', ' ', '\t')
+# bytes patterns only know ASCII word characters, any non-ASCII byte is treated as a part of a name
+bytes_scanner_tables = ScannerTables(
+    re.compile(build_master_pattern(r'(?:[^\W\d]|[\x80-\xff])(?:\w|[\x80-\xff])*').encode('ascii')),
+    {key.encode(): value for key, value in keywords.items()},
+    {key.encode(): value for key, value in operators_punctuators.items()},
+    b'\n', b' ', b'\t')
+
+tokenizers = {
+    'default': Tokenizer,
+    'scanner': ScannerTokenizer,
+}
+
+
+
+def token_begin(token: Token) -> int:
+    return token.span.begin
+
+
+def line_start(newline: Token) -> int:
+    return newline.span.end
+
 
 def take_tokens_until_type(tokens : List[Token], end_type : TokenType, include_last = False):
         res : List[Token] = []
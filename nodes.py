@@ -1,12 +1,18 @@
 from lexer import Token
 from typing import List
-from text_span import TextSpan, union_spans
+from text_span import TextSpan, union_spans, source_text
 
 class BaseNode:
+    __slots__ = ('span',)
+    # names of the child node fields in visiting order
+    _fields = ()
+
     def __init__(self, span: TextSpan) -> None:
         self.span = span
 
 class Node(BaseNode):
+    __slots__ = ('children',)
+
     def __init__(self, span : TextSpan, children : List[BaseNode] = None) -> None:
         self.children = children if children else []
         super().__init__(span)
@@ -19,32 +25,45 @@ class Node(BaseNode):
         return self.__str__()
 
 class CollectionNode(Node):
-    def __init__(self, span: TextSpan, children = []) -> None:
+    __slots__ = ()
+
+    def __init__(self, span: TextSpan, children = None) -> None:
         super().__init__(span, children)
 
 # for unsupported nodes
 class WrapperNode(Node):
+    __slots__ = ('name', 'wrapped_tokens')
+
     def __init__(self, span: TextSpan, name : str = '', wrapped_tokens: List[Token] = None) -> None:
         super().__init__(span)
         self.name = name
         self.wrapped_tokens = wrapped_tokens
 
 class Root(Node):
-    def __init__(self, span: TextSpan, nodes: List[Node] = []) -> None:
+    __slots__ = ()
+
+    def __init__(self, span: TextSpan, nodes: List[Node] = None) -> None:
         super().__init__(span, nodes)
     
     def __str__(self) -> str:
         return self.__class__.__name__
 
 class Expression(Node):
-    def __init__(self, span: TextSpan, children: List[BaseNode] = []) -> None:
+    __slots__ = ()
+
+    def __init__(self, span: TextSpan, children: List[BaseNode] = None) -> None:
         super().__init__(span, children)
 
 class Statement(Node):
-    def __init__(self, span: TextSpan, children: List[BaseNode] = []) -> None:
+    __slots__ = ()
+
+    def __init__(self, span: TextSpan, children: List[BaseNode] = None) -> None:
         super().__init__(span, children)
 
 class IfElseStatement(Statement):
+    __slots__ = ('condition', 'true_branch', 'false_branch')
+    _fields = __slots__
+
     def __init__(self, span: TextSpan, keyword: str, condition : Expression, true_branch : Statement, false_branch : Statement) -> None:
         self.condition = condition
         self.true_branch = true_branch
@@ -53,10 +72,15 @@ class IfElseStatement(Statement):
         super().__init__(span, children)
 
 class BlockStatement(Statement):
-    def __init__(self, span: TextSpan, children: List[BaseNode] = []) -> None:
+    __slots__ = ()
+
+    def __init__(self, span: TextSpan, children: List[BaseNode] = None) -> None:
         super().__init__(span, children)
 
 class ForStatement(Statement):
+    __slots__ = ('iterator', 'block')
+    _fields = __slots__
+
     def __init__(self, span: TextSpan, iterator: Expression, block: BlockStatement) -> None:
         super().__init__(span, [iterator, block])
         self.iterator = iterator
@@ -67,60 +91,96 @@ class ForStatement(Statement):
 
 
 class WhileStatement(Statement):
+    __slots__ = ('condition', 'block')
+    _fields = __slots__
+
     def __init__(self, span: TextSpan, condition : Expression, block: BlockStatement) -> None:
         super().__init__(span, [condition, block])
         self.condition = condition
         self.block = block
 
 class ReturnStatement(Statement):
+    __slots__ = ()
+
     def __init__(self, span: TextSpan, return_expr: Expression) -> None:
         super().__init__(span, [return_expr])
 
 class YieldStatement(Statement):
+    __slots__ = ()
+
     def __init__(self, span: TextSpan, return_expr: Expression) -> None:
         super().__init__(span, [return_expr])
 
 class AwaitStatement(Statement):
+    __slots__ = ()
+
     def __init__(self, span: TextSpan, return_expr: Expression) -> None:
         super().__init__(span, [return_expr])
 
 class Terminal(Expression):
-    def __init__(self, span: TextSpan, value: str) -> None:
-        self.value = value
+    __slots__ = ('_value', '_source')
+
+    def __init__(self, span: TextSpan, value: str, source = None) -> None:
+        # with a source buffer the value is sliced from it on first access
+        self._value = value
+        self._source = source
         super().__init__(span)
 
+    @property
+    def value(self) -> str:
+        if self._value is None and self._source is not None:
+            self._value = source_text(self._source, self.span.begin, self.span.end)
+        return self._value
+
     def __str__(self) -> str:
         return self.value
 
 class IdToken(Terminal):
-    def __init__(self, span: TextSpan, value: str) -> None:
-        super().__init__(span, value)
+    __slots__ = ()
+
+    def __init__(self, span: TextSpan, value: str, source = None) -> None:
+        super().__init__(span, value, source)
 
 class StringLiteral(Terminal):
-    def __init__(self, span: TextSpan, value: str) -> None:
-        super().__init__(span, value)
+    __slots__ = ()
+
+    def __init__(self, span: TextSpan, value: str, source = None) -> None:
+        super().__init__(span, value, source)
 
 class NumberLiteral(Terminal):
-    def __init__(self, span: TextSpan, value: str) -> None:
-        super().__init__(span, value)
+    __slots__ = ()
+
+    def __init__(self, span: TextSpan, value: str, source = None) -> None:
+        super().__init__(span, value, source)
 
 class NoneLiteral(Terminal):
-    def __init__(self, span: TextSpan, value: str = "None") -> None:
-        super().__init__(span, value)
+    __slots__ = ()
+
+    def __init__(self, span: TextSpan, value: str = "None", source = None) -> None:
+        super().__init__(span, value, source)
 
 class BooleanLiteral(Terminal):
-    def __init__(self, span: TextSpan, value: str) -> None:
-        super().__init__(span, value)
+    __slots__ = ()
+
+    def __init__(self, span: TextSpan, value: str, source = None) -> None:
+        super().__init__(span, value, source)
 
 class EasterEggLiteral(Terminal):
-    def __init__(self, span: TextSpan, value: str = "__peg_parser__") -> None:
-        super().__init__(span, value)
+    __slots__ = ()
+
+    def __init__(self, span: TextSpan, value: str = "__peg_parser__", source = None) -> None:
+        super().__init__(span, value, source)
 
 class OperatorLiteral(Terminal):
-    def __init__(self, span: TextSpan, value: str) -> None:
-        super().__init__(span, value)
+    __slots__ = ()
+
+    def __init__(self, span: TextSpan, value: str, source = None) -> None:
+        super().__init__(span, value, source)
 
 class LambdaExpression(Expression):
+    __slots__ = ('params', 'expr')
+    _fields = __slots__
+
     def __init__(self, span: TextSpan, params : CollectionNode, expr : Expression ) -> None:
         children = params.children.copy()
         children.append(expr)
@@ -129,6 +189,9 @@ class LambdaExpression(Expression):
         self.expr = expr
 
 class InvocationExpression(Expression):
+    __slots__ = ('target', 'arguments')
+    _fields = __slots__
+
     def __init__(self, span: TextSpan, target: Expression, arguments: List[Expression]) -> None:
         self.target = target
         prepared_args = arguments[1:-1] if len(arguments) > 2 else []
@@ -142,6 +205,9 @@ class InvocationExpression(Expression):
         return self.__str__()
 
 class ConditionalExpression(Expression):
+    __slots__ = ('condition', 'true_branch', 'false_branch')
+    _fields = __slots__
+
     def __init__(self, span: TextSpan, condition: Expression, true_branch: Expression, false_branch: Expression) -> None:
         super().__init__(span, [condition, true_branch, false_branch])
         self.condition = condition
@@ -149,6 +215,9 @@ class ConditionalExpression(Expression):
         self.false_branch = false_branch
 
 class BinaryOperatorExpression(Expression):
+    __slots__ = ('left', 'operator', 'right')
+    _fields = __slots__
+
     def __init__(self, span: TextSpan, left: Expression, operator: OperatorLiteral, right: Expression) -> None:
         super().__init__(span, [left, operator, right])
         self.left = left
@@ -156,12 +225,18 @@ class BinaryOperatorExpression(Expression):
         self.right = right
 
 class UnaryOperatorExpression(Expression):
+    __slots__ = ('operator', 'expr')
+    _fields = __slots__
+
     def __init__(self, span: TextSpan, operator: OperatorLiteral, expr: Expression) -> None:
         super().__init__(span, [operator, expr])
         self.operator = operator
         self.expr = expr
 
 class GeneratorExpression(Statement):
+    __slots__ = ('expr', 'iterator', 'conditions')
+    _fields = __slots__
+
     def __init__(self, span: TextSpan, expr: Expression, iterator: Expression, conditions: List[Expression]) -> None:
         super().__init__(span, [expr, iterator].extend(conditions))
         self.expr = expr
@@ -173,6 +248,9 @@ class GeneratorExpression(Statement):
         return f'{self.expr.__str__()} for {self.iterator.__str__()} {conditions_str}'
 
 class AssignmentExpression(Expression):
+    __slots__ = ('left', 'annotation', 'operator', 'right')
+    _fields = __slots__
+
     def __init__(self, span: TextSpan, left: Expression, operator: OperatorLiteral, right: Expression, annotation: Expression = None) -> None:
         super().__init__(span, [left, operator, right])
         self.left = left
@@ -181,16 +259,24 @@ class AssignmentExpression(Expression):
         self.right = right
 
 class IndexerExpression(Expression):
+    __slots__ = ('target', 'index')
+    _fields = __slots__
+
     def __init__(self, span: TextSpan, target: Expression, index: Expression) -> None:
         super().__init__(span, [target, index])
         self.target = target
         self.index = index
 
 class CollectionExpression(Expression):
+    __slots__ = ()
+
     def __init__(self, span: TextSpan, elements: List[Expression]) -> None: #list, dict, tuple, generator
         super().__init__(span, elements)
 
 class SliceExpression(Expression):
+    __slots__ = ('start', 'stop', 'step')
+    _fields = __slots__
+
     def __init__(self, span: TextSpan, start: Expression = None, stop: Expression = None, step: Expression = None) -> None:
         super().__init__(span, [start, stop, step])
         self.start = start
@@ -198,12 +284,18 @@ class SliceExpression(Expression):
         self.step = step
 
 class KeyValueExpression(Expression):
+    __slots__ = ('key', 'value_')
+    _fields = __slots__
+
     def __init__(self, span: TextSpan, key: Expression, value_ : Expression) -> None:
         super().__init__(span, [key, value_])
         self.key = key
         self.value_ = value_
 
 class MemberReference(Expression):
+    __slots__ = ('target', 'member')
+    _fields = __slots__
+
     def __init__(self, span: TextSpan, target: Expression, member: IdToken) -> None:
         super().__init__(span, [target, member])
         self.target = target
@@ -211,9 +303,29 @@ class MemberReference(Expression):
 
 
 class DefinitionStatement(Statement):
+    __slots__ = ('name', 'signature', 'body')
+    _fields = __slots__
+
     def __init__(self, span: TextSpan, name: IdToken, signature: Node, body: Statement) -> None:
         children = [name, signature, body]
         super().__init__(span, children=children)
         self.name = name
         self.signature = signature
         self.body = body
+
+
+def shift_node(node: BaseNode, delta: int, source = None):
+    """Moves spans of the node subtree by delta, lazy terminals are rebound to the new source"""
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        span = current.span
+        if span is not None:
+            current.span = TextSpan(span.begin + delta, span.length)
+        if source is not None and isinstance(current, Terminal) and current._source is not None:
+            current._source = source
+        # tokens inside collection nodes were already moved by the lexer
+        stack.extend(child for child in getattr(current, 'children', ()) if isinstance(child, BaseNode))
+        annotation = getattr(current, 'annotation', None)
+        if annotation is not None:
+            stack.append(annotation)
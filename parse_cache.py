@@ -0,0 +1,146 @@
+import hashlib
+import os
+from contextlib import contextmanager
+from logging import Logger
+from typing import Iterator, List, Optional, TextIO, Tuple, Union
+import serialization
+import parser_
+from arena import Arena
+from errors import SerializationError
+from token_stream import TokenStream
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+ENTRY_SUFFIX = '.astb'
+# total size of the entries, shared by every process using the directory
+SIZE_FILE = 'size'
+
+
+def cache_options(lexer: str = 'default', lazy: bool = False, mapped: bool = False, recover: bool = False) -> str:
+    """Options part of the cache key, parses made with another lexer engine or source mode never share an entry"""
+    flags = [name for name, enabled in (('lazy', lazy), ('mapped', mapped), ('recover', recover)) if enabled]
+    return '-'.join([lexer] + flags)
+
+
+class ParseCache:
+    """Serialized parses in a directory keyed by the source hash, least recently used entries are evicted above max_bytes
+
+    The size of the entries is kept in a file of the directory and updated under a file lock (where fcntl exists), so
+    processes sharing the directory enforce one limit together.
+    """
+
+    def __init__(self, directory: str, logger: Logger, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.directory = directory
+        self.logger = logger
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, source: Union[str, bytes], options: str = '') -> str:
+        content = source.encode('utf-8') if isinstance(source, str) else source
+        digest = hashlib.sha256(content).hexdigest()
+        return f'{digest}-{parser_.version}-{serialization.VERSION}{"-" + options if options else ""}'
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def get(self, source: Union[str, bytes], options: str = '') -> Optional[Tuple[TokenStream, Arena]]:
+        path = self.path(self.key(source, options))
+        try:
+            with open(path, 'rb') as entry:
+                data = entry.read()
+            _, tokens, arena = serialization.loads(data)
+        except FileNotFoundError:
+            return None
+        except (OSError, SerializationError) as ex:
+            self.logger.warning(f'Dropping unreadable cache entry {path}: {repr(ex)}')
+            self.remove(path)
+            return None
+        # the modification time orders entries for eviction
+        os.utime(path)
+        return tokens, arena
+
+    def put(self, source: Union[str, bytes], tokens, tree, options: str = ''):
+        path = self.path(self.key(source, options))
+        data = serialization.dumps(source, tokens, tree)
+        if len(data) > self.max_bytes:
+            return
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as entry:
+            entry.write(data)
+        with self.size_lock() as size_file:
+            # an entry written for the same key before is replaced, its size is no longer used
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(temporary, path)
+            size = self.read_size(size_file)
+            size = sum(size for _, size, _ in self.entries()) if size is None else size + len(data) - replaced
+            if size > self.max_bytes:
+                size = self.evict()
+            self.write_size(size_file, size)
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        result = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(ENTRY_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            result.append((stat.st_mtime, stat.st_size, path))
+        return result
+
+    def evict(self) -> int:
+        """Removes the least recently used entries until the rest fits into max_bytes, returns their size"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.remove_entry(path)
+            total -= size
+        return total
+
+    def remove(self, path: str):
+        with self.size_lock() as size_file:
+            try:
+                removed = os.stat(path).st_size
+            except FileNotFoundError:
+                return
+            self.remove_entry(path)
+            size = self.read_size(size_file)
+            if size is not None:
+                self.write_size(size_file, max(size - removed, 0))
+
+    def remove_entry(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def size_lock(self) -> Iterator[TextIO]:
+        """The size file opened and locked against the other processes using the directory"""
+        with open(os.path.join(self.directory, SIZE_FILE), 'a+') as size_file:
+            if fcntl is not None:
+                fcntl.flock(size_file, fcntl.LOCK_EX)
+            yield size_file
+
+    @staticmethod
+    def read_size(size_file: TextIO) -> Optional[int]:
+        size_file.seek(0)
+        text = size_file.read().strip()
+        return int(text) if text.isdigit() else None
+
+    @staticmethod
+    def write_size(size_file: TextIO, size: int):
+        size_file.seek(0)
+        size_file.truncate()
+        size_file.write(str(size))
+        size_file.flush()
@@ -1,23 +1,89 @@
 import nodes
-from typing import List
+from bisect import bisect_left
+from collections import deque
+from typing import List, Union
 from lexer_utils import TokenType as tt
-from lexer import Token, take_tokens_until_type
-from parser_utils import compound_stmt_tokens, comparison_tokens, assign_tokens
+from lexer import Token, token_begin
+from token_stream import TokenStream
+from parser_utils import compound_stmt_tokens, comparison_tokens, block_fields, memo_rules, LineIndex, assign_mask, for_mask, yield_mask
+from parser_utils import unsupported_statement_tokens, clause_tokens, open_bracket_tokens, close_bracket_tokens, lambda_mask
+from parser_utils import binary_precedence, right_associative_tokens, not_precedence, bitwise_or_precedence, unary_precedence, unary_arithmetic_tokens
 from logging import Logger
-from errors import ParsingError
+from errors import ParsingError, Diagnostics
+from rule_profiler import RuleProfiler
+from arena import Arena, kind_ids
 from text_span import TextSpan, union_spans
 
 
+expression_engines = ['climbing', 'chain']
+# bump when the produced trees change so cached parses are not reused
+version = '1'
+
+
 class Parser:
     @property
     def current_token(self):
         return self._tokens[self._index] if self._index < self._tokens_len else None
 
-    def __init__(self, tokens, logger: Logger) -> None:
-        self._tokens: List[Token] = tokens
+    def __init__(self, tokens, logger: Logger, source = None, memoize: bool = False, memo_window: int = 256,
+                 expression_engine: str = 'climbing', recover: bool = False, rule_profiler: RuleProfiler = None) -> None:
+        self._tokens: Union[List[Token], TokenStream] = tokens
         self._index = 0
         self._tokens_len = len(tokens)
+        self._line_index = LineIndex(tokens)
         self.logger = logger
+        # terminals keep offsets into the source instead of token values when it is given
+        self._source = source
+        if expression_engine not in expression_engines:
+            raise ValueError(f'unknown expression engine {expression_engine}')
+        # 'chain' keeps the rule per precedence level parsing
+        self._climbing = expression_engine == 'climbing'
+        # in recovery mode problems are collected here instead of being logged
+        self.diagnostics = Diagnostics() if recover else None
+        self._memo = None
+        if memoize:
+            self.enable_memo(memo_window)
+        # rules are instrumented only for a profiler, memoized rules are profiled with their cache lookups
+        if rule_profiler is not None:
+            rule_profiler.instrument(self)
+
+    def enable_memo(self, window: int):
+        """Caches results of memo_rules by token index, positions more than window tokens behind are evicted"""
+        self._memo = {}
+        self._memo_positions = deque()
+        self._memo_window = window
+        for name in memo_rules:
+            setattr(self, name, self.memoized(name, getattr(self, name)))
+
+    def memoized(self, name: str, rule):
+        memo = self._memo
+        positions = self._memo_positions
+        window = self._memo_window
+
+        def memo_rule():
+            index = self._index
+            entries = memo.get(index)
+            if entries is None:
+                entries = memo[index] = {}
+                positions.append(index)
+                limit = index - window
+                while positions[0] < limit:
+                    memo.pop(positions.popleft(), None)
+            elif (entry := entries.get(name)) is not None:
+                result, end, error = entry
+                self._index = end
+                if error is not None:
+                    raise error
+                return result
+            try:
+                result = rule()
+            except Exception as error:
+                entries[name] = (None, self._index, error)
+                raise
+            entries[name] = (result, self._index, None)
+            return result
+
+        return memo_rule
 
     def parse(self) -> nodes.Root:
         return self.file_input()
@@ -44,7 +110,157 @@ class Parser:
 
         return nodes.Root(span, children)
 
+    def parse_to_arena(self) -> Arena:
+        """Same as parse, but each top level statement is moved into an Arena right after it is parsed
+
+        This does not emit nodes from the grammar rules: they still build the object tree of every statement, which
+        is then copied with Arena.append_tree and dropped. Only one statement tree is alive at a time, which lowers
+        the retained and peak memory, but parsing allocates as many objects as parse and takes longer by the copy
+        ('benchmark.py arena' reports both).
+        """
+        arena = Arena()
+        root = arena.add(kind_ids[nodes.Root], None)
+        first_span = last_span = None
+        while token := self.current_token:
+            if token.type == tt.EOF:
+                break
+            if token.type == tt.NEWLINE:
+                self.move_next()
+                continue
+            child = self.statement()
+            if not child:
+                break
+            arena.append_tree(child, root)
+            first_span = first_span or child.span
+            last_span = child.span
+        if first_span is not None:
+            arena.set_span(root, union_spans(first_span, last_span))
+        return arena
+
+    def reparse(self, old_root: nodes.Root, damaged_span: TextSpan, delta: int) -> nodes.Root:
+        """Builds the tree for the edited tokens reusing statements of old_root outside damaged_span
+
+        damaged_span is the relexed region in old coordinates (Tokenizer.damaged_span) and delta is the
+        change of the text length. Reused statements are moved in place, so old_root must not be used afterwards.
+        """
+        children = self.reparse_statements(old_root.children, damaged_span, delta, top_level=True)
+        if len(children) == 0:
+            span = None
+        elif len(children) == 1:
+            span = children[0].span
+        else:
+            span = union_spans(children[0].span, children[-1].span)
+        return nodes.Root(span, children)
+
+    def reparse_statements(self, statements: List[nodes.Node], damaged: TextSpan, delta: int, top_level: bool = False) -> List[nodes.Node]:
+        """Returns the new statement list or None when the damage can't be handled on a block level"""
+        count = len(statements)
+        if not top_level and (count == 0 or None in statements):
+            return None
+        # statements before the first one touching the damage are kept as they are
+        first = 0
+        while first < count and statements[first].span.end < damaged.begin:
+            first += 1
+        last = first
+        while last < count and statements[last].span.begin < damaged.end:
+            last += 1
+
+        if last == first + 1 and statements[first].span.begin < damaged.begin:
+            if self.reparse_compound(statements[first], damaged, delta):
+                self.shift_statements(statements, last, delta)
+                return statements
+
+        # the line may also join the block of the preceding statement or be its else branch
+        if first == count or statements[first].span.begin >= damaged.begin:
+            first -= 1
+        if first < 0:
+            if not top_level:
+                return None
+            self._index = 0
+        else:
+            self._index = self.statement_index(statements[first].span.begin)
+
+        children = statements[:max(first, 0)]
+        while True:
+            while self.current_token.type == tt.NEWLINE:
+                self.move_next()
+            token = self.current_token
+            if token.type == tt.EOF or (token.type == tt.DEDENT and not top_level):
+                break
+            begin = token.span.begin
+            while last < count and statements[last].span.begin + delta < begin:
+                last += 1
+            if last < count and statements[last].span.begin + delta == begin:
+                self.shift_statements(statements, last, delta)
+                return children + statements[last:]
+            child = self.statement()
+            if top_level and not child:
+                return children
+            children.append(child)
+
+        if top_level:
+            return children
+        # the damaged lines must all belong to the block and the block must not take in what followed it before
+        # the edit (e.g. the body of a deleted else clause), its end may move only within the damage
+        end_limit = max(statements[-1].span.end, damaged.end) + delta
+        if last < count or self.current_token.span.begin < damaged.end + delta:
+            return None
+        if not children or children[-1] is None or children[-1].span.end > end_limit:
+            return None
+        return children
+
+    def reparse_compound(self, owner: nodes.Node, damaged: TextSpan, delta: int) -> bool:
+        """Reparses the block (or elif branch) of a compound statement holding the start of the damage"""
+        children = owner.children
+        for index, child in enumerate(children):
+            if not isinstance(child, (nodes.BlockStatement, nodes.IfElseStatement)):
+                continue
+            span = child.span
+            if not (span.begin < damaged.begin <= span.end):
+                continue
+            # a damaged header or body of a later clause may change which statements the block holds
+            if any(later is not None and later.span.begin < damaged.end for later in children[index + 1:]):
+                return False
+            if isinstance(child, nodes.BlockStatement):
+                statements = self.reparse_statements(child.children, damaged, delta)
+                if statements is None or None in statements:
+                    return False
+                new_child = nodes.BlockStatement(union_spans(statements[0].span, statements[-1].span), statements)
+            elif self.reparse_compound(child, damaged, delta):
+                new_child = child
+            else:
+                return False
+
+            children[index] = new_child
+            for field in block_fields:
+                if getattr(owner, field, None) is child:
+                    setattr(owner, field, new_child)
+            self.shift_statements(children, index + 1, delta)
+            end = new_child.span.end if owner.span.end == span.end else owner.span.end + delta
+            owner.span = TextSpan(owner.span.begin, end - owner.span.begin)
+            return True
+        return False
+
+    def shift_statements(self, statements: List[nodes.Node], start: int, delta: int):
+        if delta == 0 and self._source is None:
+            return
+        for statement in statements[start:]:
+            if statement is not None:
+                nodes.shift_node(statement, delta, self._source)
+
+    def statement_index(self, position: int) -> int:
+        begins = getattr(self._tokens, 'begins', None)
+        if begins is not None:
+            index = bisect_left(begins, position)
+        else:
+            index = bisect_left(self._tokens, position, key=token_begin)
+        while self._tokens[index].type in (tt.INDENT, tt.DEDENT):
+            index += 1
+        return index
+
     def statement(self) -> nodes.Node:
+        if self.diagnostics is not None:
+            return self.recovering_statement()
         node: nodes.Statement = None
         try:
             if self.current_token.type in compound_stmt_tokens:
@@ -56,6 +272,57 @@ class Parser:
 
         return node
 
+    def recovering_statement(self) -> nodes.Node:
+        start = self._index
+        token = self.current_token
+        kind = unsupported_statement_tokens.get(token.type)
+        if kind is None and token.type not in compound_stmt_tokens:
+            if self._line_index.line_has(start, lambda_mask):
+                kind = 'lambda'
+            elif self._line_index.line_has(start, for_mask):
+                kind = 'comprehension'
+        if kind is not None:
+            self.diagnostics.add(kind, token.span)
+            return self.skip_statement(start, kind)
+        try:
+            if token.type in compound_stmt_tokens:
+                return self.compound_stmt()
+            return self.terminated_small_stmt()
+        except Exception as ex:
+            kind = type(ex).__name__
+            self.diagnostics.add(kind, token.span, str(ex))
+            self._index = start
+            return self.skip_statement(start, kind)
+
+    def skip_statement(self, start: int, name: str) -> nodes.WrapperNode:
+        """Moves past the statement starting at start with its blocks and clauses and wraps its tokens"""
+        brackets = 0
+        indents = 0
+        last = start
+        while (token_type := self.current_token.type) != tt.EOF:
+            if token_type == tt.DEDENT and indents == 0 and brackets == 0:
+                break
+            if token_type not in (tt.NEWLINE, tt.INDENT, tt.DEDENT):
+                last = self._index
+            self.move_next()
+            if token_type in open_bracket_tokens:
+                brackets += 1
+            elif token_type in close_bracket_tokens:
+                brackets = max(brackets - 1, 0)
+            elif token_type == tt.INDENT:
+                indents += 1
+            elif token_type == tt.DEDENT:
+                indents -= 1
+                if indents == 0 and brackets == 0 and self.current_token.type not in clause_tokens:
+                    break
+            elif token_type == tt.NEWLINE and indents == 0 and brackets == 0 and self.current_token.type != tt.INDENT:
+                break
+        if self._index == start and token_type != tt.EOF:
+            self.move_next()
+        tokens = self._tokens[start: last + 1]
+        span = union_spans(self._tokens[start].span, self._tokens[last].span)
+        return nodes.WrapperNode(span, name, tokens)
+
     def compound_stmt(self) -> nodes.Statement:
         current = self.current_token
         c_type = current.type 
@@ -125,7 +392,7 @@ class Parser:
     def def_stmt(self) -> nodes.DefinitionStatement:
         def_ = self.current_token
         name_token = self.move_next()
-        name = nodes.IdToken(name_token.span, name_token.value)
+        name = self.terminal(nodes.IdToken, name_token)
         params = self.params()
         block = self.block()
         return nodes.DefinitionStatement(union_spans(def_.span, block.span), name, params, block)
@@ -140,7 +407,7 @@ class Parser:
                 self.move_next()
                 continue
             if curr.type in [tt.DIV, tt.AND_OP]:
-                params.append(nodes.Terminal(curr.span, curr.value))
+                params.append(self.terminal(nodes.Terminal, curr))
                 self.move_next()
             else:
                 params.append(self.var_decl())
@@ -200,6 +467,8 @@ class Parser:
         raise NotImplementedError('lambda_')
 
     def disjunction(self) -> nodes.Expression:
+        if self._climbing:
+            return self.binary_expression(1)
         return self.binary_by_priority(self.conjunction, [tt.OR])
 
     def conjunction(self) -> nodes.Expression:
@@ -208,7 +477,7 @@ class Parser:
     def inversion(self) -> nodes.Expression:
         if self.current_token.type == tt.NOT:
             not_token = self.current_token
-            not_node = nodes.OperatorLiteral(not_token.span, not_token.value)
+            not_node = self.terminal(nodes.OperatorLiteral, not_token)
             self.move_next()
             expr = self.inversion()
             return nodes.UnaryOperatorExpression(union_spans(not_node.span, expr.span), not_node, expr)
@@ -218,7 +487,7 @@ class Parser:
         result = self.bitwise_or()
         current = self.current_token
         if current.type in comparison_tokens:
-            op = nodes.OperatorLiteral(current.span, current.value)
+            op = self.terminal(nodes.OperatorLiteral, current)
             self.move_next()
             right = self.bitwise_or()
             return nodes.BinaryOperatorExpression(union_spans(result.span, right.span), result, op, right)
@@ -229,12 +498,14 @@ class Parser:
             if (next_t := self.current_token).type in [tt.IN, tt.NOT]:
                 op = nodes.OperatorLiteral(union_spans(first_op_token.span, next_t.span), f'{first_op_token.value} {next_t.value}')
             else:
-                op = nodes.OperatorLiteral(first_op_token.span, first_op_token.value)
+                op = self.terminal(nodes.OperatorLiteral, first_op_token)
             right = self.bitwise_or()
             return nodes.BinaryOperatorExpression(union_spans(result.span, right.span), result, op, right)
         return result
 
     def bitwise_or(self) -> nodes.Expression:
+        if self._climbing:
+            return self.binary_expression(bitwise_or_precedence)
         return self.binary_with_recursion(self.bitwise_xor, [tt.OR_OP])
 
     def bitwise_xor(self) -> nodes.Expression:
@@ -254,7 +525,7 @@ class Parser:
 
     def factor(self) -> nodes.Expression:
         if (op_token := self.current_token) in [tt.ADD, tt.SUB, tt.NOT_OP]:
-            op = nodes.OperatorLiteral(op_token.span, op_token.value)
+            op = self.terminal(nodes.OperatorLiteral, op_token)
             self.move_next()
             expr = self.power()
             return nodes.UnaryOperatorExpression(union_spans(op.span, expr.span), op, expr)
@@ -265,7 +536,7 @@ class Parser:
 
     def await_primary(self) -> nodes.Expression:
         if (op_token := self.current_token).type == tt.AWAIT:
-            op = nodes.OperatorLiteral(op_token.span, op_token.value)
+            op = self.terminal(nodes.OperatorLiteral, op_token)
             self.move_next()
             primary = self.primary()
             return nodes.UnaryOperatorExpression(union_spans(op.span, primary.span), op, primary)
@@ -275,7 +546,7 @@ class Parser:
         atom = self.atom()
         if (current := self.current_token).type == tt.DOT:
             name = self.move_next()
-            return nodes.MemberReference(union_spans(atom.span, name.span), atom, nodes.IdToken(name.span, name.value))
+            return nodes.MemberReference(union_spans(atom.span, name.span), atom, self.terminal(nodes.IdToken, name))
         elif current.type == tt.OPEN_PAREN:
             args = self.generator_args()
             return nodes.InvocationExpression(union_spans(atom.span, args[-1].span), atom, args)
@@ -352,10 +623,46 @@ class Parser:
             exprs.append(self.expression())
         return exprs
 
+    def binary_expression(self, min_precedence: int) -> nodes.Expression:
+        """Precedence climbing over binary_precedence, recursion depth is bounded by the number of levels"""
+        left = self.unary_expression(min_precedence)
+        while True:
+            op_token = self.current_token
+            precedence = binary_precedence.get(op_token.type)
+            if precedence is None or precedence < min_precedence:
+                return left
+            next_t = self.right_token()
+            if op_token.type == tt.NOT:
+                if next_t.type != tt.IN:
+                    return left
+                op = nodes.OperatorLiteral(union_spans(op_token.span, next_t.span), 'not in')
+                self.move_next(2)
+            elif op_token.type == tt.IS and next_t.type == tt.NOT:
+                op = nodes.OperatorLiteral(union_spans(op_token.span, next_t.span), 'is not')
+                self.move_next(2)
+            else:
+                op = self.terminal(nodes.OperatorLiteral, op_token)
+                self.move_next()
+            right = self.binary_expression(precedence if op_token.type in right_associative_tokens else precedence + 1)
+            left = nodes.BinaryOperatorExpression(union_spans(left.span, right.span), left, op, right)
+
+    def unary_expression(self, min_precedence: int) -> nodes.Expression:
+        op_token = self.current_token
+        if op_token.type == tt.NOT and min_precedence <= not_precedence:
+            operand_precedence = not_precedence
+        elif op_token.type in unary_arithmetic_tokens:
+            operand_precedence = unary_precedence
+        else:
+            return self.await_primary()
+        op = self.terminal(nodes.OperatorLiteral, op_token)
+        self.move_next()
+        expr = self.binary_expression(operand_precedence)
+        return nodes.UnaryOperatorExpression(union_spans(op.span, expr.span), op, expr)
+
     def binary_with_recursion(self, next_handler, operators) -> nodes.Expression:
         left = next_handler()
         if (op_token := self.current_token).type in operators:
-            op = nodes.OperatorLiteral(op_token.span, op_token.value)
+            op = self.terminal(nodes.OperatorLiteral, op_token)
             self.move_next()
             right = self.binary_by_priority(next_handler, operators)
             return nodes.BinaryOperatorExpression(union_spans(left.span, right.span), left, op, right)
@@ -365,34 +672,39 @@ class Parser:
         result = next_handler()
         while self.current_token.type in operator_types:
             op_token = self.current_token
-            op = nodes.OperatorLiteral(op_token, op_token.value)
+            op = self.terminal(nodes.OperatorLiteral, op_token)
             self.move_next()
             right = next_handler()
             result = nodes.BinaryOperatorExpression(union_spans(result.span, right.span), result, op, right)
         return result
 
     def simple_stmt(self) -> nodes.Node:
+        if self.diagnostics is not None:
+            return self.terminated_small_stmt()
         try:
-            result = self.small_stmt()
-            newline = self.current_token
-            if newline.type == tt.NEWLINE:
-                self.move_next()
-            elif newline.type not in [tt.DEDENT, tt.EOF]:
-                raise ParsingError(index= newline.span.begin , msg = f'simple statement should end with ({tt.NEWLINE}, {tt.DEDENT}, {tt.EOF})')
-            return result
+            return self.terminated_small_stmt()
         except Exception as ex:
             self.logger.error(repr(ex))
             self.move_next()
 
         return None
 
+    def terminated_small_stmt(self) -> nodes.Node:
+        result = self.small_stmt()
+        newline = self.current_token
+        if newline.type == tt.NEWLINE:
+            self.move_next()
+        elif newline.type not in [tt.DEDENT, tt.EOF]:
+            raise ParsingError(index= newline.span.begin , msg = f'simple statement should end with ({tt.NEWLINE}, {tt.DEDENT}, {tt.EOF})')
+        return result
+
     def small_stmt(self) -> nodes.Node:
         current = self.current_token
         if current.type == tt.RETURN:
             return self.return_stmt()
         if current.type in [tt.PASS, tt.BREAK, tt.CONTINUE]:
             self.move_next()
-            return nodes.Terminal(current.span, current.value)
+            return self.terminal(nodes.Terminal, current)
         if current.type == tt.STAR:
             return self.star_expressions()
         if current.type == tt.DEL:
@@ -420,9 +732,7 @@ class Parser:
 
     def assignment(self) -> nodes.AssignmentExpression:
         current = self.current_token
-        line = take_tokens_until_type(self._tokens[self._index : ], tt.NEWLINE)
-        line_types = set(map(lambda x: x.type, line))
-        if not set(assign_tokens) & set(line_types):
+        if not self._line_index.line_has(self._index, assign_mask):
             return None #TODO: complete decomposition assignments. if time remains
 
         if current.type == tt.NAME and self.right_token().type == tt.COLON:
@@ -441,7 +751,7 @@ class Parser:
         assign_part = None
         assign_op = None
         if self.current_token.type == tt.ASSIGN:
-            assign_op = nodes.OperatorLiteral(self.current_token.span, self.current_token.value)
+            assign_op = self.terminal(nodes.OperatorLiteral, self.current_token)
             self.move_next()
             assign_part = self.annotated_rhs()
 
@@ -465,22 +775,22 @@ class Parser:
         current_t = current.type
         if current_t == tt.NAME:
             self.move_next()
-            return nodes.IdToken(current.span, current.value)
+            return self.terminal(nodes.IdToken, current)
         if current_t == tt.STRING:
             self.move_next()
-            return nodes.StringLiteral(current.span, current.value)
+            return self.terminal(nodes.StringLiteral, current)
         if current_t == tt.NUMBER:
             self.move_next()
-            return nodes.NumberLiteral(current.span, current.value)
+            return self.terminal(nodes.NumberLiteral, current)
         if current_t == tt.NONE:
             self.move_next()
-            return nodes.NoneLiteral(current.span, current.value)
+            return self.terminal(nodes.NoneLiteral, current)
         if current_t == tt.PEGPARSER:
             self.move_next()
-            return nodes.EasterEggLiteral(current.span, current.value)
+            return self.terminal(nodes.EasterEggLiteral, current)
         if current_t in [tt.TRUE, tt.FALSE]:
             self.move_next()
-            return nodes.BooleanLiteral(current.span, current.value)
+            return self.terminal(nodes.BooleanLiteral, current)
         if current_t == tt.OPEN_PAREN:
             return self.tuple_group_generator()
         if current_t == tt.OPEN_BRACKET:
@@ -488,22 +798,19 @@ class Parser:
         if current_t == tt.OPEN_BRACE:
             return self.dict_()
         if current_t == tt.ELLIPSIS:
-            return nodes.OperatorLiteral(current.span, current.value)
+            return self.terminal(nodes.OperatorLiteral, current)
         raise NotImplementedError(f'atom with value {current}')
 
     def tuple_group_generator(self) -> nodes.Expression:
-        line = take_tokens_until_type(self._tokens[self._index : ], tt.NEWLINE)
-        line_types = list(map(lambda x: x.type, line))
-        if tt.FOR in line_types:
+        line_index = self._line_index
+        if line_index.line_has(self._index, for_mask):
             return self.generator()
-        if tt.YIELD in line_types:
+        if line_index.line_has(self._index, yield_mask):
             return self.group()
         return self.tuple_()
 
     def list_(self) -> nodes.CollectionExpression:
-        line = take_tokens_until_type(self._tokens[self._index : ], tt.NEWLINE)
-        line_types = list(map(lambda x: x.type, line))
-        if tt.FOR in line_types:
+        if self._line_index.line_has(self._index, for_mask):
             return self.generator()
         
         open_bracket = self.current_token
@@ -550,7 +857,7 @@ class Parser:
         current = self.current_token
         if current.type.value >= tt.ASSIGN.value and current.type.value <= tt.IDIV_ASSIGN.value:
             self.move_next()
-            return nodes.OperatorLiteral(current.span, current.value)
+            return self.terminal(nodes.OperatorLiteral, current)
         raise NotImplementedError(f'assign_op with value {current.value}')
 
     def return_statement(self) -> nodes.ReturnStatement:
@@ -581,18 +888,23 @@ class Parser:
 
     def star_expression(self) -> nodes.Expression:
         if (op_token := self.current_token).type == tt.STAR:
-            op = nodes.OperatorLiteral(op_token.span, op_token.value)
+            op = self.terminal(nodes.OperatorLiteral, op_token)
             expr = self.bitwise_or()
             return nodes.UnaryOperatorExpression(union_spans(op.span, expr.span), op, expr)
         return self.expression()
 
     def star_named_expression(self) -> nodes.Expression:
         if (op_token := self.current_token).type == tt.STAR:
-            op = nodes.OperatorLiteral(op_token.span, op_token.value)
+            op = self.terminal(nodes.OperatorLiteral, op_token)
             expr = self.bitwise_or()
             return nodes.UnaryOperatorExpression(union_spans(op.span, expr.span), op, expr)
         return self.named_expr()
 
+    def terminal(self, node_type, token: Token) -> nodes.Terminal:
+        if self._source is None:
+            return node_type(token.span, token.value)
+        return node_type(token.span, None, self._source)
+
     def move_next(self, offset : int = 1) -> Token:
         self._index += offset
         return self._tokens[self._index] if self._index < self._tokens_len else None
@@ -1,6 +1,43 @@
+from array import array
+from typing import Iterable
 from lexer_utils import TokenType as tt
 
 compound_stmt_tokens = [tt.FOR, tt.DEF, tt.IF, tt.CLASS, tt.WITH, tt.TRY, tt.WHILE]
+# statements skipped as a whole in recovery mode
+unsupported_statement_tokens = {
+    tt.CLASS: 'class',
+    tt.TRY: 'try',
+    tt.WITH: 'with',
+    tt.ASYNC: 'async',
+    tt.DEL: 'del',
+    tt.ASSERT: 'assert',
+    tt.RAISE: 'raise',
+    tt.GLOBAL: 'global',
+    tt.NONLOCAL: 'nonlocal',
+    tt.IMPORT: 'import',
+    tt.FROM: 'import',
+    tt.AT: 'decorator',
+}
+# tokens continuing a compound statement after its block
+clause_tokens = [tt.ELIF, tt.ELSE, tt.EXCEPT, tt.FINALLY]
+open_bracket_tokens = [tt.OPEN_PAREN, tt.OPEN_BRACKET, tt.OPEN_BRACE]
+close_bracket_tokens = [tt.CLOSE_PAREN, tt.CLOSE_BRACKET, tt.CLOSE_BRACE]
+# node fields holding nested statement blocks
+block_fields = ['true_branch', 'false_branch', 'block', 'body']
+# rules without arguments, their result depends only on the start token index
+memo_rules = [
+    'named_expr', 'expression', 'disjunction', 'conjunction', 'inversion', 'comparison',
+    'bitwise_or', 'bitwise_xor', 'bitwise_and', 'shift_expr', 'sum_', 'term', 'factor', 'power',
+    'await_primary', 'primary', 'atom', 'slices', 'slice_', 'assignment', 'annotated_rhs',
+    'star_expressions', 'star_named_expressions', 'star_expression', 'star_named_expression',
+]
+# grammar rule methods instrumented by the rule profiler
+profiled_rules = memo_rules + [
+    'file_input', 'statement', 'recovering_statement', 'skip_statement', 'compound_stmt', 'for_stmt', 'if_stmt',
+    'while_stmt', 'def_stmt', 'params', 'block', 'lambda_', 'generator_args', 'binary_expression', 'unary_expression',
+    'simple_stmt', 'terminated_small_stmt', 'small_stmt', 'return_stmt', 'var_decl', 'tuple_group_generator',
+    'list_', 'tuple_', 'group', 'generator', 'dict_',
+]
 comparison_tokens = [tt.EQUALS, tt.NOT_EQ_1, tt.NOT_EQ_2, tt.LT_EQ, tt.LESS_THAN, tt.GT_EQ, tt.GREATER_THAN]
 operator_tokens = [
     tt.STAR,
@@ -44,8 +81,79 @@ assign_tokens = [
     tt.IDIV_ASSIGN
 ]
 
+# binary operator precedence for the precedence climbing engine, higher binds tighter
+binary_precedence = {
+    tt.OR: 1,
+    tt.AND: 2,
+    **{token_type: 4 for token_type in comparison_tokens + [tt.IN, tt.NOT, tt.IS]},
+    tt.OR_OP: 5,
+    tt.XOR: 6,
+    tt.AND_OP: 7,
+    tt.LEFT_SHIFT: 8,
+    tt.RIGHT_SHIFT: 8,
+    tt.ADD: 9,
+    tt.SUB: 9,
+    tt.STAR: 10,
+    tt.DIV: 10,
+    tt.IDIV: 10,
+    tt.MOD: 10,
+    tt.AT: 10,
+    tt.POWER: 12,
+}
+right_associative_tokens = [tt.POWER]
+# prefix operators: 'not' sits between 'and' and comparisons, '+x', '-x', '~x' between terms and '**'
+not_precedence = 3
+bitwise_or_precedence = binary_precedence[tt.OR_OP]
+unary_precedence = 11
+unary_arithmetic_tokens = [tt.ADD, tt.SUB, tt.NOT_OP]
+
 unary_operator_tokens = [
     tt.DIV,
     tt.ADD,
     tt.NOT_OP
-]
\ No newline at end of file
+]
+
+def types_mask(types: Iterable[tt]) -> int:
+    mask = 0
+    for token_type in types:
+        mask |= 1 << (token_type.value + 1)
+    return mask
+
+
+assign_mask = types_mask(assign_tokens)
+for_mask = types_mask([tt.FOR])
+yield_mask = types_mask([tt.YIELD])
+lambda_mask = types_mask([tt.LAMBDA])
+
+
+class LineIndex:
+    """Lookahead to the end of the line for every token: the index of the next NEWLINE and the types on the way"""
+
+    def __init__(self, tokens) -> None:
+        kinds = getattr(tokens, 'kinds', None)
+        if kinds is None:
+            kinds = [token.type.value for token in tokens]
+        count = len(kinds)
+        self.line_ends = array('i', [count]) * count
+        # same masks share one int object, lines of a file use only a few type combinations
+        self.masks = [0] * count
+        interned = {}
+        newline = tt.NEWLINE.value
+        end = count
+        mask = 0
+        for index in range(count - 1, -1, -1):
+            kind = kinds[index]
+            if kind == newline:
+                end = index
+                mask = 0
+            else:
+                mask |= 1 << (kind + 1)
+            self.line_ends[index] = end
+            self.masks[index] = interned.setdefault(mask, mask)
+
+    def line_end(self, index: int) -> int:
+        return self.line_ends[index]
+
+    def line_has(self, index: int, mask: int) -> bool:
+        """Whether any token from index up to the next NEWLINE has a type from mask"""
+        return self.masks[index] & mask != 0
@@ -0,0 +1,121 @@
+import json
+import os
+import tracemalloc
+from contextlib import contextmanager
+from time import perf_counter, process_time
+from typing import Dict, Iterator, List
+
+
+def children_cpu_time() -> float:
+    """CPU time of the finished child processes (layout engines)"""
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+class Phase:
+    __slots__ = ('name', 'parent', 'wall_seconds', 'cpu_seconds', 'children_cpu_seconds', 'peak_bytes', 'retained_bytes',
+                 'counts')
+
+    def __init__(self, name: str, parent: str = None) -> None:
+        self.name = name
+        # name of the phase whose time includes this one, nested phases are left out of the totals
+        self.parent = parent
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.children_cpu_seconds = 0.0
+        self.peak_bytes: int = None
+        self.retained_bytes: int = None
+        self.counts: Dict[str, int] = {}
+
+    def to_dict(self) -> dict:
+        result = {'name': self.name, 'wall_seconds': self.wall_seconds, 'cpu_seconds': self.cpu_seconds,
+                  'children_cpu_seconds': self.children_cpu_seconds}
+        if self.parent is not None:
+            result['parent'] = self.parent
+        if self.peak_bytes is not None:
+            result['peak_bytes'] = self.peak_bytes
+            result['retained_bytes'] = self.retained_bytes
+        result.update(self.counts)
+        return result
+
+
+class PhaseProfiler:
+    """Wall time, CPU time of the process and of its children and item counts of named phases
+
+    With trace_memory, tracemalloc records the peak of memory allocated during each phase over what was allocated
+    when it started (and the part still allocated at its end), tracing slows the run down noticeably.
+    """
+
+    def __init__(self, trace_memory: bool = False) -> None:
+        self.trace_memory = trace_memory
+        self.phases: List[Phase] = []
+        self._started_tracing = False
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[Phase]:
+        """Measures the block, counts can be added to the yielded phase"""
+        phase = Phase(name)
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            tracemalloc.reset_peak()
+            allocated = tracemalloc.get_traced_memory()[0]
+        wall, cpu, children_cpu = perf_counter(), process_time(), children_cpu_time()
+        try:
+            yield phase
+        finally:
+            phase.wall_seconds = perf_counter() - wall
+            phase.cpu_seconds = process_time() - cpu
+            phase.children_cpu_seconds = children_cpu_time() - children_cpu
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                phase.peak_bytes = peak - allocated
+                phase.retained_bytes = current - allocated
+            self.phases.append(phase)
+
+    def add(self, name: str, wall_seconds: float, cpu_seconds: float, parent: str = None) -> Phase:
+        """Records a phase measured elsewhere, e.g. summed over the files processed by worker processes"""
+        phase = Phase(name, parent)
+        phase.wall_seconds = wall_seconds
+        phase.cpu_seconds = cpu_seconds
+        self.phases.append(phase)
+        return phase
+
+    def stop(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def report(self) -> dict:
+        phases = [phase for phase in self.phases if phase.parent is None]
+        return {
+            'phases': [phase.to_dict() for phase in self.phases],
+            'total': {
+                'wall_seconds': sum(phase.wall_seconds for phase in phases),
+                'cpu_seconds': sum(phase.cpu_seconds for phase in phases),
+                'children_cpu_seconds': sum(phase.children_cpu_seconds for phase in phases),
+            },
+        }
+
+    def summary(self) -> str:
+        lines = []
+        for phase in self.phases:
+            name = phase.name if phase.parent is None else '  ' + phase.name
+            line = f'{name:<10} wall {phase.wall_seconds:.4f}s, cpu {phase.cpu_seconds:.4f}s'
+            if phase.children_cpu_seconds:
+                line += f', child processes {phase.children_cpu_seconds:.4f}s'
+            if phase.peak_bytes is not None:
+                line += f', peak {phase.peak_bytes / 1024:.0f} KiB'
+            line += ''.join(f', {key} {value}' for key, value in phase.counts.items())
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def write(self, path: str):
+        """Writes the JSON report to the file, '-' prints it"""
+        text = json.dumps(self.report(), indent=2)
+        if path == '-':
+            print(text)
+            return
+        with open(path, 'w') as output:
+            output.write(text + '\n')
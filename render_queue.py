@@ -0,0 +1,120 @@
+import gzip
+import os
+import subprocess
+from logging import Logger
+from queue import Queue
+from threading import Lock, Thread
+from time import perf_counter
+from typing import List, Optional
+
+# graphviz writes the source to <path> and the rendered file to <path>.<format>, the queue keeps that layout
+DEFAULT_FORMAT = 'pdf'
+COMPRESSED_SUFFIX = '.gz'
+
+
+def rendered_path(path: str, output_format: str = DEFAULT_FORMAT) -> str:
+    if path.endswith(COMPRESSED_SUFFIX):
+        path = path[:-len(COMPRESSED_SUFFIX)]
+    return f'{path}.{output_format}'
+
+
+class RenderJob:
+    """source is None when the DOT file is already written at path (gzip compressed if it ends with .gz)"""
+    __slots__ = ('source', 'path', 'key', 'engine')
+
+    def __init__(self, source: str, path: str, key: str = '', engine: str = None) -> None:
+        self.source = source
+        self.path = path
+        self.key = key if key else path
+        self.engine = engine
+
+
+class RenderResult:
+    def __init__(self, key: str, path: str, seconds: float, error: str = '') -> None:
+        self.key = key
+        self.path = path
+        self.seconds = seconds
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return not self.error
+
+
+class RenderQueue:
+    """Renders DOT sources with a bounded number of layout engine processes
+
+    submit() blocks while capacity jobs are waiting, so producers cannot get ahead of the renderers by more
+    than that. Every job gets its own process which is killed after timeout seconds.
+    """
+
+    def __init__(self, logger: Logger, workers: int = 2, capacity: int = 8, timeout: float = 60.0,
+                 engine: str = 'dot', output_format: str = DEFAULT_FORMAT) -> None:
+        self.logger = logger
+        self.timeout = timeout
+        self.engine = engine
+        self.output_format = output_format
+        self.results: List[RenderResult] = []
+        self._lock = Lock()
+        self._jobs: Queue = Queue(maxsize=max(capacity, 1))
+        self._threads = [Thread(target=self.work, name=f'render-{i}', daemon=True) for i in range(max(workers, 1))]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, source: Optional[str], path: str, key: str = '', engine: str = None):
+        """Queues the job, engine overrides the layout engine of the queue"""
+        self._jobs.put(RenderJob(source, path, key, engine))
+
+    def work(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                if job is None:
+                    return
+                result = self.render(job)
+                with self._lock:
+                    self.results.append(result)
+            finally:
+                self._jobs.task_done()
+
+    def render(self, job: RenderJob) -> RenderResult:
+        started = perf_counter()
+        output = rendered_path(job.path, self.output_format)
+        engine = job.engine if job.engine else self.engine
+        try:
+            if job.source is not None:
+                directory = os.path.dirname(job.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(job.path, 'w') as source_file:
+                    source_file.write(job.source)
+            command = [engine, f'-T{self.output_format}', '-o', output]
+            if job.path.endswith(COMPRESSED_SUFFIX):
+                with gzip.open(job.path, 'rb') as source_file:
+                    subprocess.run(command, input=source_file.read(), capture_output=True, timeout=self.timeout, check=True)
+            else:
+                subprocess.run(command + [job.path], capture_output=True, timeout=self.timeout, check=True)
+        except subprocess.TimeoutExpired:
+            error = f'{engine} timed out after {self.timeout}s'
+        except subprocess.CalledProcessError as ex:
+            error = f'{engine} failed ({ex.returncode}): {ex.stderr.decode(errors="replace").strip()}'
+        except OSError as ex:
+            error = repr(ex)
+        else:
+            return RenderResult(job.key, output, perf_counter() - started)
+        self.logger.warning(f'Rendering of {job.path} failed: {error}')
+        return RenderResult(job.key, output, perf_counter() - started, error)
+
+    def close(self) -> List[RenderResult]:
+        """Waits for the submitted jobs and stops the workers"""
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+        return self.results
+
+    def __enter__(self) -> 'RenderQueue':
+        return self
+
+    def __exit__(self, *_):
+        self.close()
@@ -0,0 +1,85 @@
+from collections import defaultdict
+from time import perf_counter
+from typing import Dict, List
+from parser_utils import profiled_rules
+
+# collapsed stack values are integer microseconds of self time, the unit flame graph tools expect
+STACK_UNIT = 1e6
+
+
+class RuleStats:
+    __slots__ = ('calls', 'tokens', 'self_seconds', 'total_seconds')
+
+    def __init__(self) -> None:
+        self.calls = 0
+        # tokens consumed by the rule including its nested rules
+        self.tokens = 0
+        self.self_seconds = 0.0
+        # time of the outermost active calls, recursive calls are not counted twice
+        self.total_seconds = 0.0
+
+
+class RuleProfiler:
+    """Calls, consumed tokens and self/total time of the grammar rules of a Parser and self time per rule stack
+
+    instrument() replaces the rule methods of one parser instance with timing wrappers, parsers that are not
+    instrumented run the plain methods.
+    """
+
+    def __init__(self) -> None:
+        self.stats: Dict[str, RuleStats] = defaultdict(RuleStats)
+        self.stacks: Dict[str, float] = defaultdict(float)
+        # [stack path, time of nested rules] of the active calls
+        self._frames: List[list] = []
+        self._active: Dict[str, int] = defaultdict(int)
+
+    def instrument(self, parser, rules: List[str] = None):
+        for name in rules if rules is not None else profiled_rules:
+            setattr(parser, name, self.profiled(parser, name, getattr(parser, name)))
+
+    def profiled(self, parser, name: str, rule):
+        frames = self._frames
+        active = self._active
+        stats = self.stats[name]
+        stacks = self.stacks
+
+        def profiled_rule(*args, **kwargs):
+            frame = [f'{frames[-1][0]};{name}' if frames else name, 0.0]
+            frames.append(frame)
+            active[name] += 1
+            start = parser._index
+            started = perf_counter()
+            try:
+                return rule(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - started
+                frames.pop()
+                active[name] -= 1
+                if frames:
+                    frames[-1][1] += elapsed
+                stats.calls += 1
+                stats.tokens += max(parser._index - start, 0)
+                stats.self_seconds += elapsed - frame[1]
+                if not active[name]:
+                    stats.total_seconds += elapsed
+                stacks[frame[0]] += elapsed - frame[1]
+
+        return profiled_rule
+
+    def collapsed(self) -> List[str]:
+        """Lines of 'rule;nested rule;... microseconds' for flamegraph.pl, speedscope and similar tools"""
+        return [f'{path} {round(seconds * STACK_UNIT)}' for path, seconds in sorted(self.stacks.items())
+                if round(seconds * STACK_UNIT) > 0]
+
+    def write_collapsed(self, path: str):
+        with open(path, 'w') as output:
+            output.writelines(line + '\n' for line in self.collapsed())
+
+    def summary(self, top: int = 15) -> str:
+        lines = [f'{"rule":<24} {"calls":>9} {"tokens":>9} {"self ms":>9} {"total ms":>9}']
+        rules = sorted(self.stats.items(), key=lambda item: -item[1].self_seconds)
+        for name, stats in rules[:top]:
+            if stats.calls:
+                lines.append(f'{name:<24} {stats.calls:>9} {stats.tokens:>9} '
+                             f'{stats.self_seconds * 1000:>9.1f} {stats.total_seconds * 1000:>9.1f}')
+        return '\n'.join(lines)
@@ -0,0 +1,248 @@
+import struct
+import sys
+import zlib
+from array import array
+from itertools import accumulate
+from typing import BinaryIO, List, Tuple, Union
+import nodes
+from arena import Arena, node_types, field_names
+from errors import SerializationError
+from lexer import Token
+from token_stream import TokenStream
+
+MAGIC = b'ASTB'
+VERSION = 3
+# flags
+BYTES_SOURCE = 1
+# the body after the header is zlib compressed
+COMPRESSED = 2
+
+# payload tags
+NONE_VALUE = 0
+STRING_VALUE = 1
+TOKEN_VALUE = 2
+
+# magic, version, flags and the CRC-32 of everything after the header
+header_format = struct.Struct('<4sHHI')
+count_format = struct.Struct('<I')
+
+
+class Writer:
+    def __init__(self) -> None:
+        self.chunks: List[bytes] = []
+        self.strings: List[str] = []
+        self.string_ids = {}
+
+    def string(self, value: str) -> int:
+        string_id = self.string_ids.get(value)
+        if string_id is None:
+            string_id = self.string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return string_id
+
+    def count(self, value: int):
+        self.chunks.append(count_format.pack(value))
+
+    def blob(self, data: bytes):
+        self.count(len(data))
+        self.chunks.append(data)
+
+    def column(self, column: array):
+        if sys.byteorder == 'big':
+            column = array('i', column)
+            column.byteswap()
+        self.count(len(column))
+        self.chunks.append(column.tobytes())
+
+
+class Reader:
+    def __init__(self, data: bytes) -> None:
+        self.data = memoryview(data)
+        self.position = 0
+
+    def take(self, size: int) -> memoryview:
+        end = self.position + size
+        if end > len(self.data):
+            raise SerializationError(index=self.position, msg='unexpected end of data')
+        chunk = self.data[self.position: end]
+        self.position = end
+        return chunk
+
+    def count(self) -> int:
+        return count_format.unpack(self.take(count_format.size))[0]
+
+    def blob(self) -> memoryview:
+        return self.take(self.count())
+
+    def column(self, typecode: str = 'i') -> array:
+        column = array(typecode)
+        size = self.count()
+        column.frombytes(self.take(size * column.itemsize))
+        if sys.byteorder == 'big':
+            column.byteswap()
+        return column
+
+    def deltas(self) -> array:
+        return array('i', accumulate(self.column()))
+
+
+def deltas(column: array) -> array:
+    """Differences of consecutive values, the begins of tokens and nodes in pre-order mostly grow by small steps"""
+    return array('i', [column[0]] + [value - previous for previous, value in zip(column, column[1:])]) if column else column
+
+
+def dumps(source: Union[str, bytes], tokens: Union[List[Token], TokenStream], tree: Union[Arena, nodes.Root]) -> bytes:
+    """Serializes the source, its tokens and the tree
+
+    Layout after the header: source, token kind/begin/length columns, kind and field name tables, arena columns,
+    payload columns (tag, a, b) and the string table (offsets into one utf-8 blob), all little-endian and zlib
+    compressed. Token and node begins are stored as differences from the previous begin and node ends as lengths.
+    """
+    if not isinstance(tree, Arena):
+        root = tree
+        tree = Arena()
+        tree.append_tree(root)
+    if not isinstance(tokens, TokenStream):
+        tokens = TokenStream.from_tokens(tokens, source)
+
+    writer = Writer()
+    flags = 0
+    if isinstance(source, str):
+        source_bytes = source.encode('utf-8')
+    else:
+        source_bytes = bytes(source)
+        flags |= BYTES_SOURCE
+    writer.blob(source_bytes)
+    for column in (tokens.kinds, deltas(tokens.begins), tokens.lengths):
+        writer.column(column)
+
+    # kinds and fields are stored by name so the file survives reordering of the node classes
+    writer.column(array('i', [writer.string(node_type.__name__) for node_type in node_types]))
+    writer.column(array('i', [writer.string(name) for name in field_names]))
+    lengths = array('i', [end - begin for begin, end in zip(tree.begins, tree.ends)])
+    for column in (tree.kinds, deltas(tree.begins), lengths, tree.first_child, tree.next_sibling, tree.payloads,
+                   tree.fields):
+        writer.column(column)
+
+    tags = array('i')
+    first = array('i')
+    second = array('i')
+    for value in tree.values:
+        if value is None:
+            tags.append(NONE_VALUE)
+            first.append(-1)
+            second.append(-1)
+        elif isinstance(value, str):
+            tags.append(STRING_VALUE)
+            first.append(writer.string(value))
+            second.append(-1)
+        else:
+            token_type, text = value
+            tags.append(TOKEN_VALUE)
+            first.append(token_type)
+            second.append(writer.string(text) if text is not None else -1)
+    for column in (tags, first, second):
+        writer.column(column)
+
+    offsets = array('i', [0])
+    for string in writer.strings:
+        offsets.append(offsets[-1] + len(string))
+    writer.column(offsets)
+    writer.blob(''.join(writer.strings).encode('utf-8'))
+    # zero runs and repeated small values of the columns compress well even at the fastest level
+    body = zlib.compress(b''.join(writer.chunks), 1)
+    flags |= COMPRESSED
+    return header_format.pack(MAGIC, VERSION, flags, zlib.crc32(body)) + body
+
+
+def loads(data: bytes) -> Tuple[Union[str, bytes], TokenStream, Arena]:
+    """Inverse of dumps, raises SerializationError for data that is truncated, corrupted or of another version"""
+    reader = Reader(data)
+    magic, version, flags, checksum = header_format.unpack(reader.take(header_format.size))
+    if magic != MAGIC:
+        raise SerializationError(msg='not a serialized parse')
+    if version != VERSION:
+        raise SerializationError(msg=f'unsupported format version {version}')
+    if zlib.crc32(reader.data[reader.position:]) != checksum:
+        raise SerializationError(index=reader.position, msg='checksum mismatch')
+    try:
+        if flags & COMPRESSED:
+            reader = Reader(zlib.decompress(reader.data[reader.position:]))
+        return read_body(reader, flags)
+    except (UnicodeDecodeError, IndexError, ValueError, zlib.error) as ex:
+        raise SerializationError(ex, reader.position, 'malformed data') from ex
+
+
+def read_body(reader: Reader, flags: int) -> Tuple[Union[str, bytes], TokenStream, Arena]:
+    source_bytes = reader.blob()
+    source = bytes(source_bytes) if flags & BYTES_SOURCE else str(source_bytes, 'utf-8')
+    tokens = TokenStream(source)
+    tokens.kinds = reader.column()
+    tokens.begins = reader.deltas()
+    tokens.lengths = reader.column()
+
+    kind_names = reader.column()
+    field_name_ids = reader.column()
+    arena = Arena()
+    arena.kinds = reader.column()
+    arena.begins = reader.deltas()
+    arena.ends = array('i', map(int.__add__, arena.begins, reader.column()))
+    arena.first_child = reader.column()
+    arena.next_sibling = reader.column()
+    arena.payloads = reader.column()
+    arena.fields = reader.column()
+    tags = reader.column()
+    first = reader.column()
+    second = reader.column()
+
+    offsets = reader.column()
+    text = str(reader.blob(), 'utf-8')
+    strings = [text[offsets[i]: offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+    remap_names(arena.kinds, [strings[i] for i in kind_names], [node_type.__name__ for node_type in node_types], 'node kind')
+    remap_fields(arena.fields, [strings[i] for i in field_name_ids])
+
+    values = []
+    for tag, a, b in zip(tags, first, second):
+        if tag == STRING_VALUE:
+            values.append(strings[a])
+        elif tag == TOKEN_VALUE:
+            values.append((a, strings[b] if b >= 0 else None))
+        else:
+            values.append(None)
+    arena.values = values
+    arena._value_ids = None
+    arena._last_child = None
+    return source, tokens, arena
+
+
+def remap_names(column: array, saved: List[str], current: List[str], what: str):
+    if saved == current[:len(saved)]:
+        return
+    ids = {name: index for index, name in enumerate(current)}
+    missing = [name for name in saved if name not in ids]
+    if missing:
+        raise SerializationError(msg=f'unknown {what} {missing[0]}')
+    mapping = [ids[name] for name in saved]
+    for index, value in enumerate(column):
+        column[index] = mapping[value]
+
+
+def remap_fields(column: array, saved: List[str]):
+    if saved == field_names[:len(saved)]:
+        return
+    ids = {name: index for index, name in enumerate(field_names)}
+    missing = [name for name in saved if name not in ids]
+    if missing:
+        raise SerializationError(msg=f'unknown node field {missing[0]}')
+    mapping = [ids[name] for name in saved]
+    for index, code in enumerate(column):
+        column[index] = mapping[code >> 1] << 1 | code & 1
+
+
+def dump(file: BinaryIO, source: Union[str, bytes], tokens: Union[List[Token], TokenStream], tree: Union[Arena, nodes.Root]):
+    file.write(dumps(source, tokens, tree))
+
+
+def load(file: BinaryIO) -> Tuple[Union[str, bytes], TokenStream, Arena]:
+    return loads(file.read())
@@ -0,0 +1,106 @@
+from random import Random
+from typing import List
+
+# only constructs the parser supports: no parenthesized groups, member access, list or dict displays
+binary_operators = ['+', '-', '*', '//', '%', '<<', '|', '&', '^', '**']
+comparison_operators = ['<', '>', '==', '!=', '<=', '>=']
+augmented_operators = ['+=', '-=', '*=', '|=']
+string_literals = ["'text'", '"value"', "'a b c'", '"x"']
+INDENT = '    '
+
+
+class SyntheticSource:
+    """Deterministic Python source generator
+
+    Scaled by line count, block nesting depth, operands per expression (width) and the share of literal operands.
+    """
+
+    def __init__(self, depth: int = 2, width: int = 4, literal_density: float = 0.3, seed: int = 0) -> None:
+        self.depth = depth
+        self.width = max(width, 1)
+        self.literal_density = literal_density
+        self.random = Random(seed)
+        self.functions = 0
+        self.lines: List[str] = []
+
+    def generate(self, lines: int) -> str:
+        while len(self.lines) < lines:
+            if self.random.random() < 0.7:
+                self.definition()
+            else:
+                self.statement(0, self.depth)
+        return '\n'.join(self.lines) + '\n'
+
+    def emit(self, level: int, line: str):
+        self.lines.append(INDENT * level + line)
+
+    def definition(self):
+        name = f'function{self.functions}'
+        self.functions += 1
+        self.emit(0, f'def {name}(a, b, c):')
+        self.block(1, self.depth)
+        self.emit(1, f'return {self.expression()}')
+
+    def block(self, level: int, depth: int):
+        for _ in range(self.random.randint(2, 4)):
+            self.statement(level, depth)
+
+    def statement(self, level: int, depth: int):
+        choice = self.random.random()
+        if depth > 0 and choice < 0.3:
+            kind = self.random.choice(['if', 'while', 'for'])
+            if kind == 'for':
+                self.emit(level, f'for item in {self.call()}:')
+            else:
+                self.emit(level, f'{kind} {self.condition()}:')
+            self.block(level + 1, depth - 1)
+            if kind == 'if' and self.random.random() < 0.5:
+                self.emit(level, 'else:')
+                self.block(level + 1, depth - 1)
+        elif choice < 0.6:
+            self.emit(level, f'{self.name()} = {self.expression()}')
+        elif choice < 0.75:
+            self.emit(level, f'{self.name()} {self.random.choice(augmented_operators)} {self.expression()}')
+        elif choice < 0.9:
+            self.emit(level, self.call())
+        else:
+            self.emit(level, f'{self.name()} = {self.operand()} if {self.condition()} else {self.operand()}')
+
+    def name(self) -> str:
+        return f'{self.random.choice("abcvxyz")}{self.random.randint(0, 99)}'
+
+    def literal(self) -> str:
+        choice = self.random.random()
+        if choice < 0.6:
+            return str(self.random.randint(0, 10000))
+        if choice < 0.9:
+            return self.random.choice(string_literals)
+        return self.random.choice(['None', 'True', 'False'])
+
+    def operand(self) -> str:
+        if self.random.random() < self.literal_density:
+            return self.literal()
+        if self.random.random() < 0.1:
+            return f'-{self.name()}'
+        return self.name()
+
+    def expression(self) -> str:
+        parts = [self.operand()]
+        for _ in range(self.random.randint(1, self.width) - 1):
+            parts.append(self.random.choice(binary_operators))
+            parts.append(self.operand())
+        return ' '.join(parts)
+
+    def condition(self) -> str:
+        condition = f'{self.expression()} {self.random.choice(comparison_operators)} {self.operand()}'
+        if self.random.random() < 0.3:
+            condition += f' and not {self.name()}'
+        return condition
+
+    def call(self) -> str:
+        arguments = ', '.join(self.expression() for _ in range(self.random.randint(0, 3)))
+        return f'call{self.random.randint(0, 9)}({arguments})'
+
+
+def generate(lines: int, depth: int = 2, width: int = 4, literal_density: float = 0.3, seed: int = 0) -> str:
+    return SyntheticSource(depth, width, literal_density, seed).generate(lines)
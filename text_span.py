@@ -1,4 +1,6 @@
 class TextSpan:
+    __slots__ = ('begin', 'length', 'end')
+
     def __init__(self, begin: int, length : int) -> None:
         self.begin = begin
         self.length = length
@@ -16,4 +18,9 @@ def union_spans(s1: TextSpan, s2: TextSpan) -> TextSpan:
     begin = s1.begin if s1.begin < s2.begin else s2.begin
     end = s1.end if s1.end > s2.end else s2.end
 
-    return TextSpan(begin, end - begin)
\ No newline at end of file
+    return TextSpan(begin, end - begin)
+
+
+def source_text(source, begin: int, end: int) -> str:
+    text = source[begin: end]
+    return text if isinstance(text, str) else bytes(text).decode('utf-8')
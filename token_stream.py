@@ -0,0 +1,98 @@
+from array import array
+from typing import Iterable, Iterator, List, Union
+from lexer_utils import TokenType
+from text_span import TextSpan, source_text
+
+# TokenType values start from -1 (EOF)
+token_types: List[TokenType] = [None] * (max(t.value for t in TokenType) + 2)
+for token_type in TokenType:
+    token_types[token_type.value + 1] = token_type
+
+
+class TokenView:
+    __slots__ = ('_stream', '_index')
+
+    def __init__(self, stream: 'TokenStream', index: int) -> None:
+        self._stream = stream
+        self._index = index
+
+    @property
+    def type(self) -> TokenType:
+        return token_types[self._stream.kinds[self._index] + 1]
+
+    @property
+    def value(self) -> str:
+        return self._stream.value_at(self._index)
+
+    @property
+    def span(self) -> TextSpan:
+        return self._stream.span_at(self._index)
+
+    def __str__(self):
+        return f'({self.type}, {repr(self.value)})'
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class TokenStream:
+    """Token list stored as kind/begin/length columns over the source text"""
+
+    def __init__(self, source: str) -> None:
+        self.source = source
+        self.kinds = array('i')
+        self.begins = array('i')
+        self.lengths = array('i')
+
+    @classmethod
+    def from_tokens(cls, tokens: Iterable, source: str) -> 'TokenStream':
+        stream = cls(source)
+        stream.extend(tokens)
+        return stream
+
+    def append(self, token_type: TokenType, begin: int, length: int):
+        self.kinds.append(token_type.value)
+        self.begins.append(begin)
+        self.lengths.append(length)
+
+    def extend(self, tokens: Iterable):
+        kinds_append = self.kinds.append
+        begins_append = self.begins.append
+        lengths_append = self.lengths.append
+        for token in tokens:
+            span = token.span
+            kinds_append(token.type.value)
+            begins_append(span.begin)
+            lengths_append(span.length)
+
+    def type_at(self, index: int) -> TokenType:
+        return token_types[self.kinds[index] + 1]
+
+    def value_at(self, index: int) -> str:
+        if self.kinds[index] == TokenType.EOF.value:
+            return None
+        begin = self.begins[index]
+        return source_text(self.source, begin, begin + self.lengths[index])
+
+    def span_at(self, index: int) -> TextSpan:
+        return TextSpan(self.begins[index], self.lengths[index])
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.itemsize * len(column) for column in (self.kinds, self.begins, self.lengths))
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[TokenView, List[TokenView]]:
+        if isinstance(index, slice):
+            return [TokenView(self, i) for i in range(*index.indices(len(self.kinds)))]
+        if index < 0:
+            index += len(self.kinds)
+        if index < 0 or index >= len(self.kinds):
+            raise IndexError('token index out of range')
+        return TokenView(self, index)
+
+    def __iter__(self) -> Iterator[TokenView]:
+        for index in range(len(self.kinds)):
+            yield TokenView(self, index)
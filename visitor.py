@@ -0,0 +1,65 @@
+from typing import Callable, Dict, List, Tuple
+import nodes
+
+# named child fields by node class, an empty tuple means the node has positional children only
+_child_fields: Dict[type, Tuple[str, ...]] = {}
+
+
+def child_fields(node_type: type) -> Tuple[str, ...]:
+    fields = _child_fields.get(node_type)
+    if fields is None:
+        fields = _child_fields[node_type] = tuple(getattr(node_type, '_fields', ()))
+    return fields
+
+
+def named_children(node: nodes.BaseNode) -> List[Tuple[str, nodes.BaseNode]]:
+    """(field name, child) pairs of the non-empty fields, or ('', child) for every positional child"""
+    fields = child_fields(type(node))
+    if not fields:
+        return [('', child) for child in getattr(node, 'children', ())]
+    return [(name, child) for name in fields if (child := getattr(node, name)) is not None]
+
+
+def count_nodes(root: nodes.BaseNode) -> int:
+    """Nodes in the tree, tokens kept as children are not counted"""
+    count = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(child for child in getattr(node, 'children', ()) if child is not None and hasattr(child, 'children'))
+    return count
+
+
+class NodeVisitor:
+    """Calls visit_<class name> of the node class or of its nearest base class, generic_visit when there is none
+
+    Handlers are resolved once per node class and cached for every visitor class separately.
+    """
+    _handlers: Dict[type, Callable] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._handlers = {}
+
+    def visit(self, node: nodes.BaseNode, *args):
+        handler = self._handlers.get(type(node))
+        if handler is None:
+            handler = self.resolve(type(node))
+        return handler(self, node, *args)
+
+    @classmethod
+    def resolve(cls, node_type: type) -> Callable:
+        handler = cls.generic_visit
+        for base in node_type.__mro__:
+            method = getattr(cls, f'visit_{base.__name__}', None)
+            if method is not None:
+                handler = method
+                break
+        cls._handlers[node_type] = handler
+        return handler
+
+    def generic_visit(self, node: nodes.BaseNode, *args):
+        for _, child in named_children(node):
+            if child is not None:
+                self.visit(child, *args)
@@ -1,226 +1,171 @@
-import graphviz as g
 import nodes
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 from enum import Enum
 from lexer_utils import TokenType
 from logging import Logger
+from text_span import source_text
+from graph_sink import GraphSink, GraphvizSink
+from visitor import named_children
+from cfg import BasicBlock, BlockKind, ControlFlowGraph, EdgeKind, build_cfg
 
 class VisualizingMode(Enum):
     AST = 0
     CFG = 1
 
-class SubTree:
-    def __init__(self, key, children, is_branching) -> None:
-        self.key = key
-        self.children = children
-        self.branching = is_branching
-    
-    def __str__(self) -> str:
-        return f'{str(self.keys)} {self.branching}'
-    
-    def __repr__(self) -> str:
-        return self.__str__()
+# layout cost of dot grows superlinearly, bigger graphs are laid out by the fallback engine
+DOT_NODE_LIMIT = 4000
+FALLBACK_ENGINE = 'sfdp'
+
+cfg_block_titles = {BlockKind.IF: 'If', BlockKind.FOR: 'For', BlockKind.WHILE: 'While'}
+cfg_edge_styles = {
+    EdgeKind.NEXT: {},
+    EdgeKind.TRUE: {'label': 'True', 'color': 'green'},
+    EdgeKind.FALSE: {'label': 'False', 'color': 'red'},
+    EdgeKind.LOOP_ENTRY: {'label': 'Loop entry', 'color': 'purple'},
+    EdgeKind.ITERATION: {'label': 'Iteration', 'color': 'blue'},
+    EdgeKind.DEFINITION: {'label': 'Definition entry', 'color': 'purple'},
+}
+
+class GraphBudget:
+    """Limits of the AST graph, 0 means no limit
+
+    Subtrees deeper than max_depth, past max_nodes emitted nodes or with at most collapse_size nodes are replaced
+    by a "N hidden nodes" placeholder. Graphs with more than dot_node_limit nodes are laid out by FALLBACK_ENGINE.
+    """
+
+    def __init__(self, max_depth: int = 0, max_nodes: int = 0, collapse_size: int = 0, dot_node_limit: int = DOT_NODE_LIMIT) -> None:
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.collapse_size = collapse_size
+        self.dot_node_limit = dot_node_limit
+
+    @property
+    def limits_tree(self) -> bool:
+        return self.max_depth > 0 or self.max_nodes > 0 or self.collapse_size > 0
 
 class Visualizer:
 
-    def __init__(self, root : nodes.Root, file_name: str, source_code : str, output_file : str, logger : Logger) -> None:
+    def __init__(self, root : nodes.Root, file_name: str, source_code : str, output_file : str, logger : Logger,
+                 budget: GraphBudget = None, coalesce: bool = False) -> None:
         self.root = root
+        self.coalesce = coalesce
+        self.budget = budget if budget else GraphBudget()
+        self.sizes: Dict[int, int] = {}
         self.file_name = file_name
         self.output = output_file if output_file and len(output_file) > 0 else 'output/output'
         self.logger = logger
         self.id = 0
-        self.graph = g.Digraph(f"Visualizing of {file_name}")
+        self.graph: GraphSink = None
         self.source_code = source_code
-        self.fields_to_exclude = ['children', 'value', 'span', 'wrapped_tokens']
-        self.definitions : List[str] = []
 
-    def visualize(self, mode : VisualizingMode):
-        self.id = 0
-        self.graph = g.Digraph(f"Visualizing of {self.file_name}")
+    def visualize(self, mode : VisualizingMode, render: bool = True) -> str:
+        """Builds the graph with graphviz and renders it with dot, or only returns the DOT source when render is False"""
+        sink = GraphvizSink(self.graph_name())
+        self.write(mode, sink)
+        if render:
+            sink.render(self.output_path(mode), self.layout_engine())
+        return sink.source
 
-        if mode == VisualizingMode.AST:
-            self.visualize_ast('Root', self.root)
-        elif mode == VisualizingMode.CFG:
-            self.visualize_cfg('Root', self.root)
-        self.graph.render(f'{self.output}{mode}')
+    def write(self, mode : VisualizingMode, sink: GraphSink):
+        """Streams the nodes and edges into the sink and closes it"""
+        self.id = 0
+        self.graph = sink
+        try:
+            if mode == VisualizingMode.AST:
+                self.sizes = self.subtree_sizes(self.root) if self.budget.limits_tree else {}
+                self.visualize_ast('Root', self.root)
+            elif mode == VisualizingMode.CFG:
+                self.visualize_cfg(build_cfg(self.root, self.coalesce))
+        finally:
+            sink.close()
 
+    def graph_name(self) -> str:
+        return f'Visualizing of {self.file_name}'
 
-    def visualize_ast(self, name: str, node: nodes.Node) ->  str:
-        key = self.add_node(name, node)
-        children = self.get_children(node)
-
-        if isinstance(node, nodes.WrapperNode):
-            return key
+    def output_path(self, mode : VisualizingMode) -> str:
+        return f'{self.output}{mode}'
 
-        if len(children) == 0 and hasattr(node, 'children'):
-            for child in node.children:
-                child_key = self.visualize_ast('', child)
-                self.graph.edge(key, child_key)
-        else:
-            for name, child in children:
-                if child is None:
-                    continue
-                child_key = self.visualize_ast(name, child)
-                self.graph.edge(key, child_key)
-        return key
+    def layout_engine(self) -> str:
+        """Layout engine for the last built graph"""
+        limit = self.budget.dot_node_limit
+        return FALLBACK_ENGINE if limit > 0 and self.id > limit else 'dot'
 
-    def visualize_cfg(self, name: str, node: nodes.Node) -> List[str]:
-        keys = self.visualize_cfg_for_node(name, node)
-        if keys:
-            return keys
 
-        return self.visualize_children(name, node)
-    
-    def visualize_children(self, name, node) -> List[str]:
+    def visualize_ast(self, name: str, node: nodes.Node, depth: int = 0) ->  str:
         key = self.add_node(name, node)
-        children = self.get_children(node)
-
-        child_keys: List[SubTree] = []
-        if len(children) == 0 and hasattr(node, 'children'):
-            for child in node.children:
-                if not child:
-                    continue
-                child_keys.append(self.visualize_cfg('', child))
-        else:
-            for name, child in children:
-                if not child:
-                    continue
-                child_keys.append(self.visualize_cfg(name, child))
-
-        if len(child_keys) > 0:
-            first = child_keys[0]
-            while isinstance(first, list):
-                first = first[0]
-            self.graph.edge(key, first)
-            self.add_edges_by_list(child_keys)
-        return [key, child_keys]
-
-    def visualize_cfg_for_node(self, name, node: nodes.Node)-> List[str]:
-        if isinstance(node, nodes.WrapperNode) or issubclass(node.__class__, nodes.Expression):
-            return self.add_node(name, node)
-        if isinstance(node, nodes.BlockStatement):
-            st_keys = []
-            for st in node.children:
-                st_keys.append(self.visualize_cfg('', st))
-            self.add_edges_by_list(st_keys)
-            return [st_keys[0], st_keys[-1]] if len(st_keys) > 1 else st_keys
-        if isinstance(node, nodes.IfElseStatement):
-            return self.prepare_if_execution(node)
-        if isinstance(node, nodes.ForStatement):
-            return self.prepare_loop_execution('For', node.iterator, node.block)
-        if isinstance(node, nodes.WhileStatement):
-            return self.prepare_loop_execution('While', node.condition, node.block)
-        if isinstance(node, nodes.DefinitionStatement):
-            return self.prepare_def_execution(node)
-        if isinstance(node, nodes.ReturnStatement):
-            return self.prepare_return_execution(node)
-        return None
-
-    def prepare_loop_execution(self, keyword, iterator_condition, node_block):
-        iterator = self.visualize_cfg(keyword, iterator_condition)
-        block = self.visualize_cfg('', node_block)
-        first = block[0]
-        while isinstance(first, list):
-            first = first[0]
-        self.graph.edge(iterator, first, color='purple', label='Loop entry')
-        last = block[-1]
-        while isinstance(last[-1], list):
-            last = last[-1]
-        if isinstance(last, list):
-            for st in last:
-                self.graph.edge(st, iterator, color='blue', label='Iteration')
-        else:
-            self.graph.edge(last, iterator, color='blue', label='Iteration')
-        return [iterator]
-
-    def prepare_if_execution(self, node : nodes.IfElseStatement):
-        keys = []
-        condition = self.visualize_cfg('If', node.condition)
-        keys.append(condition)
-        branches = []
-        true_b = self.visualize_cfg('True', node.true_branch)
-        first = true_b[0]
-        while isinstance(first, list):
-            first = first[0]
-        self.graph.edge(condition, first, label ='True', color = 'green')
-        branches.append(true_b[-1])
-
-        false_b = None
-        if node.false_branch and isinstance(node.false_branch, nodes.IfElseStatement):
-            false_b = self.prepare_if_execution(node.false_branch)
-            self.graph.edge(condition, false_b[0], label ='False', color = 'red')
-            false_b = false_b[-1]
-        elif node.false_branch:
-            false_b = self.visualize_cfg('False', node.false_branch) if node.false_branch else None
-            self.graph.edge(condition, false_b[0], label ='False', color = 'red')
-            false_b = false_b[-1]
-
-        if false_b:
-            if isinstance(false_b, list):
-                branches.extend(false_b)
-            else:
-                branches.append(false_b)
-        return [condition, branches]
+        hidden = 0
+        for name, child in self.ast_children(node):
+            if self.is_hidden(child, depth + 1):
+                hidden += self.sizes[id(child)]
+                continue
+            child_key = self.visualize_ast(name, child, depth + 1)
+            self.graph.edge(key, child_key)
+        if hidden:
+            self.graph.edge(key, self.add_placeholder(hidden), style='dashed')
+        return key
 
-    def prepare_def_execution(self, node: nodes.DefinitionStatement) -> List[str]:
-        def_title = f'{node.name}{self.get_text_for_node(node.signature)}'
-        self.definitions.append(def_title)
-        key = str(self.id)
-        self.graph.node(key, def_title)
-        self.id += 1
-        body = self.visualize_cfg('', node.body)
-        first = body[0]
-        while isinstance(first, list):
-            first = first[-1]
-        self.graph.edge(key, first, color='purple', label='Definition entry')
-        self.definitions.pop()
-        return [key]
-    
-    def prepare_return_execution(self, node: nodes.ReturnStatement) -> List[str]:
+    def ast_children(self, node: nodes.Node) -> List[Tuple[str, nodes.Node]]:
+        if isinstance(node, nodes.WrapperNode):
+            return []
+        return named_children(node)
+
+    def subtree_sizes(self, root: nodes.Node) -> Dict[int, int]:
+        """Node counts of the AST graph subtrees by node id"""
+        sizes = {}
+        stack = [(root, False)]
+        while stack:
+            node, visited = stack.pop()
+            children = self.ast_children(node)
+            if visited:
+                sizes[id(node)] = 1 + sum(sizes[id(child)] for _, child in children)
+                continue
+            stack.append((node, True))
+            stack.extend((child, False) for _, child in children)
+        return sizes
+
+    def is_hidden(self, node: nodes.Node, depth: int) -> bool:
+        budget = self.budget
+        if not budget.limits_tree:
+            return False
+        size = self.sizes[id(node)]
+        return (0 < budget.max_depth < depth
+                or 0 < budget.max_nodes <= self.id
+                or 1 < size <= budget.collapse_size)
+
+    def add_placeholder(self, count: int) -> str:
         key = str(self.id)
-        text = self.get_text_for_node(node)
-        if len(self.definitions) > 0:
-            text = f'Exit from {self.definitions[-1]}\n{text}'
-        self.graph.node(key, text, color='red')
+        self.graph.node(key, f'{count} hidden node{"s" if count > 1 else ""}', shape='box', style='dashed')
         self.id += 1
-        return [key]
-
-    def add_edges_by_list(self, keys : list):
-        for index in range(1, len(keys)):
-            current = keys[index]
-            prev = keys[index - 1]
-            if isinstance(current, list):
-                self.add_tail_to_heads(prev, current)
-            elif isinstance(prev, list):
-                self.add_tails_to_head(prev, current)
-            else:
-                self.graph.edge(prev, current)
-
-    def add_tail_to_heads(self, tail, heads):
-        for head in heads:
-            if isinstance(head, list):
-                    continue
-            elif isinstance(tail, list):
-                self.add_tails_to_head(tail, head)
-                return
-            else:
-                self.graph.edge(tail, head)
-
-    def add_tails_to_head(self, tails, head):
-        for tail in tails[::-1]:
-            if isinstance(head, list):
-                self.add_tail_to_heads(tail, head)
-            elif isinstance(tail, list):
-                if len(tail) == 0:
-                    return
-                while isinstance(tail[-1], list):
-                    tail = tail[-1]
-                for t in tail:
-                    self.graph.edge(t, head)
-                return
+        return key
+
+    def visualize_cfg(self, graph: ControlFlowGraph):
+        for block in graph.blocks:
+            label = self.get_block_label(block)
+            if block.kind == BlockKind.RETURN:
+                self.graph.node(str(block.id), label, color='red')
             else:
-                self.graph.edge(tail, head)
-                return
+                self.graph.node(str(block.id), label)
+        for tail, head, kind in graph.edges():
+            self.graph.edge(str(tail), str(head), **cfg_edge_styles[kind])
+        self.id = len(graph)
+
+    def get_block_label(self, block: BasicBlock) -> str:
+        if block.kind == BlockKind.ENTRY:
+            return 'Root\n\n'
+        if block.kind == BlockKind.DEFINITION:
+            return self.get_definition_title(block.statements[0])
+        if block.kind == BlockKind.RETURN:
+            text = self.get_text_for_node(block.statements[0])
+            return f'Exit from {self.get_definition_title(block.function)}\n{text}' if block.function else text
+        if len(block.statements) > 1:
+            lines = '\n'.join(self.get_text_for_node(node) for node in block.statements)
+            return f'Basic block\n\n{lines}'
+        node = block.statements[0]
+        title = cfg_block_titles.get(block.kind)
+        return f'{title if title else node.__class__.__name__}\n\n{self.get_text_for_node(node)}'
+
+    def get_definition_title(self, node: nodes.DefinitionStatement) -> str:
+        return f'{node.name}{self.get_text_for_node(node.signature)}'
 
     def add_node(self, node_name: str, node: nodes.Node) -> str:
         key = str(self.id)
@@ -229,9 +174,6 @@ class Visualizer:
         self.id += 1
         return key
 
-    def get_children(self, node: nodes.Node) -> list:
-        return list(filter(lambda x: x[0] not in self.fields_to_exclude, node.__dict__.items()))
-
     def get_text_for_node(self, node: nodes.Node) -> str:
         if isinstance(node, TokenType):
             return str(node)
@@ -240,4 +182,4 @@ class Visualizer:
         if issubclass(type(node), nodes.Terminal):
             return node.value
         else:
-            return self.source_code[node.span.begin: node.span.end]
\ No newline at end of file
+            return source_text(self.source_code, node.span.begin, node.span.end)
\ No newline at end of file